@@ -1,9 +1,12 @@
-from sqlalchemy import func, text
+from sqlalchemy import text
 from flask import Blueprint, request
 from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import jwt_required
 from psycopg2 import errorcodes
 from Functions.Decorator_functions import authorise_as_admin, any_user
+from Functions.Query_functions import keyset_page, page_response
+from Functions.Search_functions import search_names
+from Functions.Cache_functions import etag, table_fingerprint
 from Models.recipe_allergies import RecipeAllergy
 
 from init import db
@@ -44,20 +47,13 @@ def create_allergy():
 @allergy_bp.route("/")
 @jwt_required()
 @any_user
+@etag(lambda: table_fingerprint(Allergy))
 def get_ingredient():
-    # query Allergy and select all allergies
-    all_allergies = db.select(Allergy)
-    stmt = db.session.scalars(all_allergies)
-
     # check if the search query parameter is true
     search = request.args.get("search")
     if search:
         # query the Allergy table for allergy names that are similar to the query parameter
-        search_allergy = (
-            db.session.query(Allergy)
-            .filter(func.lower(Allergy.name).ilike(f"%{search.lower()}%"))
-            .all()
-        )
+        search_allergy = search_names(Allergy, search)
         # if the query returns allergies then return them to the user
         if search_allergy:
             return allergies_schema.dump(search_allergy), 200
@@ -65,8 +61,9 @@ def get_ingredient():
         # error msg didn't find any allergies with a similar name to the query parameter
         else:
             return {"Error": f"No Allergies with the name '{search}' found."}, 404
-    # return all of the allergies if theres no query parameter in the request
-    return allergies_schema.dump(stmt)
+    # return a page of the allergies if theres no query parameter in the request
+    allergies, next_cursor = keyset_page(db.select(Allergy), [(Allergy.id, False)])
+    return page_response(allergies_schema.dump(allergies), next_cursor)
 
 
 # -------------------------------------------------------------------
@@ -1,14 +1,44 @@
 from datetime import date
-from flask import Blueprint
+from urllib.parse import quote
+import click
+from flask import Blueprint, current_app, g
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func
+from flask_migrate import stamp
+from flask_migrate.cli import db as migrate_commands
 from init import db
 from Functions.seeding_function import seed_data
+from Functions.bulk_seeding_function import seed_bulk
+from Functions.Index_functions import refresh_allergy_masks
+from Functions.Rating_functions import refresh_ratings
+from Functions.Decorator_functions import invalidate_auth_user
+from Functions.Cache_functions import response_cache
+from Functions.Query_functions import (
+    QueryCounter,
+    MAX_BATCH_SIZE,
+    MAX_PAGE_SIZE,
+    unindexed_foreign_keys,
+    sequential_scans,
+)
+from Models.recipe import Recipe
+from Models.ingredient import Ingredient
+from Models.review import Review
+from Models.user import User
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
 
 db_commands = Blueprint("db", __name__)
 
+# flask-migrate also registers its commands under "flask db" but this blueprint's group hides them, so I add them to this group instead (flask db upgrade, flask db migrate etc.)
+for name, command in migrate_commands.commands.items():
+    db_commands.cli.add_command(command, name)
+
 
 @db_commands.cli.command("create")
 def create_tables():
     db.create_all()
+    # create_all builds the latest schema so mark the database as being on the newest migration, otherwise "flask db upgrade" would try to create everything again
+    stamp()
     print("Tables created")
 
 
@@ -47,6 +77,183 @@ def seed_tables():
 
     # add reviews to the recipes
     db.session.add_all(reviews)
+    db.session.commit()
 
+    # fill in the allergy bitmask and the rating totals on every recipe now the recipe_allergy rows and reviews exist
+    refresh_allergy_masks()
+    refresh_ratings()
     db.session.commit()
     print("Tables seeded")
+
+
+@db_commands.cli.command("seed-bulk")
+@click.option("--users", type=click.IntRange(min=2), default=1000)
+@click.option("--recipes", type=click.IntRange(min=1), default=10000)
+@click.option("--reviews-per-recipe", type=click.FloatRange(min=0), default=5)
+@click.option("--ingredients", type=click.IntRange(min=1), default=2000)
+@click.option("--ingredients-per-recipe", type=click.IntRange(min=1), default=10)
+@click.option(
+    "--seed", type=int, default=None, help="random seed, for the same data every run"
+)
+def seed_bulk_tables(
+    users, recipes, reviews_per_recipe, ingredients, ingredients_per_recipe, seed
+):
+    # adds a large amount of generated data on top of whatever is already in the database, for load testing. See Functions/bulk_seeding_function.py for how it is generated
+    totals = seed_bulk(
+        users,
+        recipes,
+        reviews_per_recipe,
+        ingredients=ingredients,
+        ingredients_per_recipe=ingredients_per_recipe,
+        seed=seed,
+    )
+    print(
+        f"Seeded {users} users, {recipes} recipes, {totals['reviews']} reviews, "
+        f"{totals['recipe_ingredient']} recipe ingredients and "
+        f"{totals['recipe_allergy']} recipe allergies"
+    )
+
+
+@db_commands.cli.command("rebuild-allergy-masks")
+def rebuild_allergy_masks():
+    # recalculates every recipe's allergy bitmask from recipe_allergy, only needed if the rows were changed outside the api
+    refresh_allergy_masks()
+    db.session.commit()
+    print("Allergy masks rebuilt")
+
+
+@db_commands.cli.command("rebuild-ratings")
+def rebuild_ratings():
+    # recalculates every recipe's review_count, rating_sum and rating_avg from the reviews table
+    refresh_ratings()
+    db.session.commit()
+    print("Recipe ratings rebuilt")
+
+
+# the recipe read endpoints "flask db count-queries" calls and the most SQL statements each one may send. A page is one query for the recipes plus one per eager loaded collection, the user lookup for the token adds one and every endpoint has its own extras (the ETag check, the ingredient lookup for match). Pages and batches are capped well under the 500 ids a selectin load sends in one query, so none of these grow with the number of rows in the database.
+RECIPE_READ_QUERY_LIMITS = {
+    "list recipes": 5,
+    "list top rated recipes": 5,
+    "one recipe": 7,
+    "search": 5,
+    "match": 6,
+    "batch": 5,
+}
+
+
+def recipe_read_paths():
+    # the endpoint url for each read path, using whatever recipes are in the database
+    recipe_ids = db.session.scalars(
+        db.select(Recipe.id).order_by(Recipe.id).limit(MAX_BATCH_SIZE)
+    ).all()
+    if not recipe_ids:
+        raise click.ClickException("There are no recipes to read, seed the database")
+    title = db.session.scalar(db.select(Recipe.title).filter_by(id=recipe_ids[0]))
+    ingredient = db.session.scalar(
+        db.select(Ingredient.name)
+        .join(RecipeIngredient)
+        .filter(RecipeIngredient.recipe_id == recipe_ids[0])
+        .limit(1)
+    )
+    return {
+        "list recipes": f"/recipes/?limit={MAX_PAGE_SIZE}",
+        "list top rated recipes": f"/recipes/?sort=top_rated&limit={MAX_PAGE_SIZE}",
+        "one recipe": f"/recipes/{recipe_ids[0]}",
+        "search": f"/recipes/search?q={quote(title.split()[0])}&limit={MAX_PAGE_SIZE}",
+        "match": f"/recipes/match?ingredient={quote(ingredient or '')}&limit={MAX_PAGE_SIZE}",
+        "batch": f"/recipes/batch?ids={','.join(map(str, recipe_ids))}",
+    }
+
+
+def count_recipe_read_queries(app):
+    # sends a request to each recipe read endpoint through the test client and returns {name: (status code, queries)}
+    user_id = db.session.scalar(db.select(func.min(User.id)))
+    token = create_access_token(identity=str(user_id))
+    headers = {"Authorization": f"Bearer {token}"}
+    client = app.test_client()
+
+    # the response cache would answer repeats without the database, so it is off while counting
+    cache_backend, response_cache.backend = response_cache.backend, None
+    counts = {}
+    try:
+        for name, url in recipe_read_paths().items():
+            # the first match request builds the ingredient index, so every path is sent once before it is counted
+            client.get(url, headers=headers)
+            # the requests share this command's app context, so start each one with an empty session and no user looked up yet
+            db.session.expunge_all()
+            g.pop("auth_user", None)
+            invalidate_auth_user(user_id)
+            with QueryCounter(db.engine) as counter:
+                response = client.get(url, headers=headers)
+            counts[name] = (response.status_code, counter.count)
+    finally:
+        response_cache.backend = cache_backend
+    return counts
+
+
+@db_commands.cli.command("count-queries")
+def count_queries():
+    # calls the recipe read endpoints against whatever is in the database and counts the SQL statements each one sends, seed the database first (a big one from seed-bulk shows the counts don't grow with it)
+    failed = False
+    for name, (status, count) in count_recipe_read_queries(current_app).items():
+        limit = RECIPE_READ_QUERY_LIMITS[name]
+        print(f"{name}: {count} queries (limit {limit}), status {status}")
+        if count > limit or status != 200:
+            failed = True
+
+    if failed:
+        raise click.ClickException("A recipe read path ran more queries than expected")
+
+
+@db_commands.cli.command("check-indexes")
+def check_indexes():
+    # reports foreign keys without an index and the model queries the database plans to answer by reading a whole table. Small tables are often scanned even when there is an index, so run this against a big seeded database (flask db seed-bulk)
+    problems = 0
+    for table, columns in unindexed_foreign_keys():
+        print(f"unindexed foreign key: {table}({', '.join(columns)})")
+        problems += 1
+
+    # plan the queries with the newest rows so the ids exist
+    recipe_id = db.session.scalar(db.select(func.max(Recipe.id))) or 1
+    user_id = db.session.scalar(db.select(func.max(User.id))) or 1
+    ingredient_id = (
+        db.session.scalar(db.select(func.max(RecipeIngredient.ingredient_id))) or 1
+    )
+    allergy_id = db.session.scalar(db.select(func.max(RecipeAllergy.allergy_id))) or 1
+    queries = {
+        "recipe by id": db.select(Recipe).filter(Recipe.id == recipe_id),
+        "recipes of a user": db.select(Recipe).filter(Recipe.user_id == user_id),
+        "top rated recipes": db.select(Recipe)
+        .order_by(Recipe.rating_avg.desc(), Recipe.id.desc())
+        .limit(50),
+        "reviews of a recipe": db.select(Review)
+        .filter(Review.recipe_id == recipe_id)
+        .order_by(Review.rating.desc(), Review.created.desc(), Review.id.desc())
+        .limit(50),
+        "reviews of a user": db.select(Review).filter(Review.user_id == user_id),
+        "ingredients of recipes": db.select(RecipeIngredient).filter(
+            RecipeIngredient.recipe_id.in_([recipe_id])
+        ),
+        "recipes using an ingredient": db.select(RecipeIngredient).filter(
+            RecipeIngredient.ingredient_id == ingredient_id
+        ),
+        "allergies of recipes": db.select(RecipeAllergy).filter(
+            RecipeAllergy.recipe_id.in_([recipe_id])
+        ),
+        "recipes with an allergy": db.select(RecipeAllergy).filter(
+            RecipeAllergy.allergy_id == allergy_id
+        ),
+    }
+
+    for name, stmt in queries.items():
+        tables = sequential_scans(stmt)
+        if tables is None:
+            print(f"can't read query plans from {db.engine.dialect.name}")
+            break
+        if tables:
+            print(f"sequential scan: {name} reads all of {', '.join(tables)}")
+            problems += 1
+
+    if problems:
+        raise click.ClickException(f"{problems} indexing problems found")
+    print("Every foreign key is indexed and no query scans a whole table")
@@ -0,0 +1,14 @@
+from flask import Blueprint
+from flask_jwt_extended import jwt_required
+from Functions.Decorator_functions import authorise_as_admin
+from Functions.Profiler_functions import profiler
+
+debug_bp = Blueprint("debug", __name__, url_prefix="/debug")
+
+
+# summary of the recently profiled requests, per endpoint averages plus the slowest statements and any N+1 warnings. Only registered when PROFILE_REQUESTS is on and only administrators can see it as it includes SQL
+@debug_bp.route("/profile")
+@jwt_required()
+@authorise_as_admin
+def get_profile():
+    return profiler.summary(), 200
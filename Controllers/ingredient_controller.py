@@ -1,9 +1,12 @@
-from sqlalchemy import func, text
+from sqlalchemy import text
 from flask import Blueprint, request
 from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import jwt_required
 from psycopg2 import errorcodes
 from Functions.Decorator_functions import authorise_as_admin, any_user
+from Functions.Query_functions import keyset_page, page_response
+from Functions.Search_functions import search_names
+from Functions.Cache_functions import etag, table_fingerprint
 from Models.recipe_ingredients import RecipeIngredient
 
 from init import db
@@ -47,20 +50,13 @@ def create_ingredient():
 @ingredient_bp.route("/")
 @jwt_required()
 @any_user
+@etag(lambda: table_fingerprint(Ingredient))
 def get_ingredient():
-    # select all of the Ingredients in the database
-    all_ingredients = db.select(Ingredient)
-    stmt = db.session.scalars(all_ingredients)
-
     # checks it search parameter is true
     search = request.args.get("search")
     if search:
         # query the database for ingredient names that are like the query parameter
-        search_ingredient = (
-            db.session.query(Ingredient)
-            .filter(func.lower(Ingredient.name).ilike(f"%{search.lower()}%"))
-            .all()
-        )
+        search_ingredient = search_names(Ingredient, search)
         # if ingredients with similar name exist then we return them to the user
         if search_ingredient:
             return ingredients_schema.dump(search_ingredient), 200
@@ -68,7 +64,11 @@ def get_ingredient():
         # if there no ingredients then return msg no ingredients match that name
         else:
             return {"Error": f"No Ingredients with the name '{search}' found."}, 404
-    return ingredients_schema.dump(stmt), 200
+    # otherwise return a page of the ingredients in the database
+    ingredients, next_cursor = keyset_page(
+        db.select(Ingredient), [(Ingredient.id, False)]
+    )
+    return page_response(ingredients_schema.dump(ingredients), next_cursor), 200
 
 
 # -------------------------------------------------------------------
@@ -0,0 +1,17 @@
+import hmac
+from flask import Blueprint, current_app, request
+from Functions.Metrics_functions import metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+# request latency, status codes, connection pool and bcrypt numbers in the prometheus text format. Only registered with METRICS_ENABLED=true, and prometheus has to send the METRICS_TOKEN as a bearer token since the numbers show the api's internals
+@metrics_bp.route("/metrics")
+def get_metrics():
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    # compare_digest so the time taken doesn't give away how much of the token was right
+    if not hmac.compare_digest(
+        token.encode(), current_app.config["METRICS_TOKEN"].encode()
+    ):
+        return {"error": "A valid metrics token is required"}, 401
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
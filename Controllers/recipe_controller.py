@@ -1,17 +1,41 @@
-from sqlalchemy import func, text
+from sqlalchemy import func
 from flask import Blueprint, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from init import db
 from sqlalchemy.exc import IntegrityError, DataError
-from Models.recipe import Recipe, recipe_schema, recipes_schema
+from Models.recipe import (
+    Recipe,
+    recipe_schema,
+    recipe_serializer_for,
+)
 from Models.ingredient import Ingredient
-from Models.allergy import Allergy
 from Models.recipe_allergies import RecipeAllergy
 from Models.recipe_ingredients import RecipeIngredient
-from Models.user import User
 from Models.review import Review
 from psycopg2 import errorcodes
-from Functions.Decorator_functions import user_owner, any_user
+from Functions.Decorator_functions import user_owner, any_user, current_auth_user
+from Functions.Query_functions import (
+    select_recipes,
+    batch_ids,
+    recipe_fields,
+    keyset_page,
+    page_response,
+    export_response,
+    page_limit,
+)
+from Functions.Search_functions import search_recipes
+from Functions.Cache_functions import response_cache, etag, touch, recipe_fingerprint
+from Functions.Index_functions import (
+    recipe_index,
+    allergy_mask,
+    exclude_allergies_filter,
+)
+from Functions.Recipe_functions import (
+    add_recipe_ingredients,
+    add_recipe_allergies,
+    sync_recipe_ingredients,
+    sync_recipe_allergies,
+)
 
 db_recipes = Blueprint("recipes", __name__, url_prefix="/recipes")
 
@@ -32,81 +56,46 @@ def create_recipe():
         # check if recipe title already exists as I wanted the recipe title to be unique in this API even though the ERD model and relations would allow for duplicate recipes title.
         if Recipe.query.filter_by(title=body_data.get("title")).first():
             return {"error": "Recipe title already in use"}, 409
-        # get the user identity
-        user_id = get_jwt_identity()
-        # get the user's name and email
-        user = User.query.get(user_id)
-
-        # Check if the user exists
-        if not user:
-            return {"error": "User not found"}, 404
+        # the any_user decorator has already looked up the user for this request
+        user = current_auth_user()
 
         # create recipe instance
         recipe = Recipe(
             title=body_data.get("title"),
-            user=user,
+            user_id=user.id,
             difficulty=body_data.get("difficulty"),
             serving_size=body_data.get("serving_size"),
             instructions=body_data.get("instructions"),
         )
-        # add and commit to database before making related tables
+        # flush (not commit) so the recipe gets its id, everything below is saved in the same transaction
         db.session.add(recipe)
-        db.session.commit()
+        db.session.flush()
 
-        # get id of new recipe
-        recipe = Recipe.query.filter_by(title=recipe.title).first()
-
-        # add ingredients to recipe
-        ingredients_data = body_data.get("ingredients")
-        if ingredients_data:
-            # I decided that I would send this data into the api as a list of dictonaries { ingredient: {"name": "ingredient"}, "amount": "String" },  this made the most logical sense to pass the ingredient with the amount.
-            for ingredient_data in ingredients_data:
-                ingredient_name = ingredient_data.get("ingredient", {}).get("name")
-                amount = ingredient_data.get("amount")
-                # check if ingredient exist in database
-                ingredient = Ingredient.query.filter_by(name=ingredient_name).first()
-                # if it doesn't we create a new instance of the ingredient
-                if not ingredient:
-                    ingredient = Ingredient(name=ingredient_name)
-                    db.session.add(ingredient)
-                    db.session.commit()
-
-                # Create RecipeIngredient instance this will not exist as we are creating this recipe for the first time
-                recipe_ingredient = RecipeIngredient(
-                    recipe_id=recipe.id, ingredient=ingredient, amount=amount
-                )
+        # add ingredients to recipe. I decided that I would send this data into the api as a list of dictonaries { ingredient: {"name": "ingredient"}, "amount": "String" },  this made the most logical sense to pass the ingredient with the amount.
+        # missing ingredients are created and all the recipe_ingredient rows are inserted in one go
+        ingredient_ids = add_recipe_ingredients(recipe.id, body_data.get("ingredients"))
 
-                db.session.add(recipe_ingredient)
-                db.session.commit()
-
-        # add allergies to recipe
-        allergies = body_data.get("allergies")
-        if allergies:
-            # I decide allgeries could just be a simple list when sent to the api
-            for allergy_data in allergies:
-                # query to see if the allergy exists already
-                allergy_name = allergy_data.get("allergy", {}).get("name")
-                allergy = Allergy.query.filter_by(name=allergy_name).first()
-                # if it doesn't we create a new instance
-                if not allergy:
-                    allergy = Allergy(name=allergy_name)
-                    db.session.add(allergy)
-                    db.session.commit()
-
-                # Create RecipeAllergy relation this will also be unique as we creating this for the first time
-                recipe_allergy = RecipeAllergy(
-                    recipe_id=recipe.id, allergy_id=allergy.id
-                )
-                db.session.add(recipe_allergy)
-                db.session.commit()
+        # add allergies to recipe the same way
+        allergy_ids = add_recipe_allergies(recipe.id, body_data.get("allergies"))
+        recipe.allergy_mask = allergy_mask(allergy_ids)
+
+        # one commit for the recipe and all of its relations
+        recipe_id, title = recipe.id, recipe.title
+        db.session.commit()
+
+        # add the new recipe to the ingredient index used by /recipes/match
+        recipe_index.set_recipe(recipe_id, ingredient_ids)
 
         # simple return msg with recipe title and 201 created code
-        return {"message": f"Recipe {recipe.title} was created successfully"}, 201
+        return {"message": f"Recipe {title} was created successfully"}, 201
 
     except DataError as err:
+        # undo anything from this request that was already sent to the database
+        db.session.rollback()
         return {"error": str(err)}, 400
 
     except IntegrityError as err:
+        db.session.rollback()
         if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
             return {"error": f"The {err.orig.diag.column_name} is required"}, 400
         if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
@@ -118,108 +107,211 @@ def create_recipe():
 # CRUD - READ
 
 
+# the allergies a client wants to avoid are passed as a comma separated list
+def excluded_allergies():
+    return request.args.get("exclude_allergies", "").split(",")
+
+
+# every recipe read below takes ?fields=id,title,... and ?include=ingredients,allergies,... to only get (and only load) part of each recipe, see recipe_fields in Functions/Query_functions.py
+
+
+# the orders the recipe listing can be sorted in as keyset keys, the id at the end keeps recipes with the same rating in a stable order
+RECIPE_SORTS = {
+    "id": [(Recipe.id, False)],
+    "top_rated": [(Recipe.rating_avg, True), (Recipe.id, True)],
+}
+
+
 # Get Data on all recipes in the database
 @db_recipes.route("/")
 @jwt_required()
 @any_user
+@response_cache.cached
 def get_all_recipes():
-    # select all recipes
-    stmt = db.select(Recipe)
-    # serialized it
-    recipes = db.session.scalars(stmt)
-    # return to user
-    return recipes_schema.dump(recipes), 200
+    # select all recipes with the relations the response needs eager loaded
+    fields = recipe_fields()
+    stmt = select_recipes(fields)
+    # leave out recipes with any of the allergies in ?exclude_allergies=Pork,Dairy
+    allergy_filter = exclude_allergies_filter(excluded_allergies())
+    if allergy_filter is not None:
+        stmt = stmt.filter(allergy_filter)
+    # only fetch one page of recipes, ordered by id or with ?sort=top_rated by the stored average rating
+    sort = request.args.get("sort", "id")
+    if sort not in RECIPE_SORTS:
+        return {"error": f"'sort' must be one of {', '.join(RECIPE_SORTS)}"}, 400
+    recipes, next_cursor = keyset_page(stmt, RECIPE_SORTS[sort])
+    # serialize and return to user
+    return (
+        page_response(
+            recipe_serializer_for(fields, many=True).dump(recipes), next_cursor
+        ),
+        200,
+    )
 
 
 # Get data on one recipe in the database pass the recipe id as an argument
+# the response has an ETag, send it back in If-None-Match and you get an empty 304 if the recipe hasn't changed
 @db_recipes.route("/<int:recipe_id>")
 @jwt_required()
 @any_user
+@etag(recipe_fingerprint)
+@response_cache.cached
 def get_recipe(recipe_id):
     # select recipe by the id
-    stmt = db.select(Recipe).filter_by(id=recipe_id)
+    fields = recipe_fields()
+    stmt = select_recipes(fields).filter_by(id=recipe_id)
     # serialize it
     recipe = db.session.scalar(stmt)
     # return to the user
-    return recipe_schema.dump(recipe), 200
+    return recipe_serializer_for(fields).dump(recipe), 200
+
+
+# Get many recipes by id in one request, GET /recipes/batch?ids=1,2,3 or POST /recipes/batch with {"ids": [1, 2, 3]} for longer lists
+# the recipes come back in the order the ids were sent and any ids that don't exist are listed in "missing"
+def recipes_batch_response(ids):
+    # one query for the recipes and one per eager loaded collection, however many ids are sent
+    fields = recipe_fields()
+    stmt = select_recipes(fields).filter(Recipe.id.in_(ids))
+    recipes = {recipe.id: recipe for recipe in db.session.scalars(stmt).unique()}
+    return {
+        "data": recipe_serializer_for(fields, many=True).dump(
+            [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes]
+        ),
+        "missing": [recipe_id for recipe_id in ids if recipe_id not in recipes],
+    }, 200
 
 
-# search for a recipe with specific ingredient or title in the database requires query parameter
-# acceptable parameters names ["ingredient", "title"]
+@db_recipes.route("/batch")
+@jwt_required()
+@any_user
+@response_cache.cached
+def get_recipes_batch():
+    return recipes_batch_response(batch_ids())
+
+
+# the POST version reads a body so it isn't cached
+@db_recipes.route("/batch", methods=["POST"])
+@jwt_required()
+@any_user
+def post_recipes_batch():
+    return recipes_batch_response(batch_ids())
+
+
+# Stream every recipe in the database as newline delimited json, used by the sync jobs that need the whole catalogue
+@db_recipes.route("/export")
+@jwt_required()
+@any_user
+def export_recipes():
+    fields = recipe_fields()
+    return export_response(
+        select_recipes(fields), recipe_serializer_for(fields), Recipe.id
+    )
+
+
+# search for recipes in the database requires at least one query parameter
+# acceptable parameters names ["q", "title", "ingredient", "allergy"], q searches the title and instructions, ingredient and allergy can be passed more than once and every filter has to match
 @db_recipes.route("/search")
 @jwt_required()
 @any_user
 def get_recipe_by_ingredient():
-    # route handles 2 possible query parameters
-    ingredient = request.args.get("ingredient")
+    # route handles 4 possible query parameters
+    text = request.args.get("q")
     title = request.args.get("title")
+    ingredients = request.args.getlist("ingredient")
+    allergies = request.args.getlist("allergy")
+    fields = recipe_fields()
 
     # if no query is sent it will return a error message with code 400 for bad request
-    if not ingredient and not title:
-        return {"Error": "Please provide either 'ingredient' or 'title'."}, 400
-
-    # first check if the ingredient parameter is true
-    if ingredient:
-        # Construct the SQL query to search for the recipes with that ingredient. I tried to use sql alchmey but I couldn't query the data properly, but the raw sql works fine.
-        """
-        # Main query
-        SELECT * FROM recipes     =      selects all columns from recipes in the database
-
-        #sub query 1
-        WHERE id IN (SELECT recipe_id FROM recipe_ingredient)      =      selects the ingredients that are in specific recipe
-
-        # sub query 2
-        WHERE ingredient_id IN (SELECT id FROM ingredient WHERE LOWER(name) LIKE LOWER (:ingredient))     =      selects the ingredients that is like the ingredient variable that is passed to query, I used lower so it becomes a case insensitive search.
-        """
-
-        sql_query = """
-            SELECT *
-            FROM recipes
-            WHERE id IN (
-            SELECT recipe_id
-            FROM recipe_ingredient
-            WHERE ingredient_id IN (
-                SELECT id
-                FROM ingredient
-                WHERE LOWER(name) LIKE LOWER(:ingredient)
-            )
-        );
-        """
-
-        # Execute the SQL query with the provided ingredient variable
-        recipes = db.session.execute(
-            text(sql_query), {"ingredient": f"%{ingredient}%"}
-        ).fetchall()
-
-        # Check if any recipes were found
-        if recipes:
-            return recipes_schema.dump(recipes), 200
+    if not text and not title and not ingredients and not allergies:
+        return {"Error": "Please provide 'q', 'title', 'ingredient' or 'allergy'."}, 400
+
+    # the search engine ranks the results so the best matches come first
+    recipes = search_recipes(
+        text=text,
+        title=title,
+        ingredients=ingredients,
+        allergies=allergies,
+        exclude_allergies=excluded_allergies(),
+        limit=page_limit(),
+        fields=fields,
+    )
+
+    #  if it finds recipes that match it will return them
+    if recipes:
+        return recipe_serializer_for(fields, many=True).dump(recipes), 200
+    # simple error msg if it cant find a matching recipe
+    else:
+        return {"Error": "No recipes matching the search found."}, 404
 
-        else:
-            return {
-                "Error": f"No recipes with the ingredient '{ingredient}' found."
-            }, 404
-
-    # check if the title query is true
-    if title:
-        # just query the recipe for its name using the ilike function again
-        recipes_by_name = (
-            db.session.query(Recipe)
-            .filter(func.lower(Recipe.title).ilike(f"%{title.lower()}%"))
-            .all()
+
+# find the recipes you can cook with the ingredients you have, pass each ingredient name as an "ingredient" query parameter
+# recipes are ranked by how many of the ingredients they use, then by how few other ingredients they need. add ?all=true to only get recipes that use every ingredient
+@db_recipes.route("/match")
+@jwt_required()
+@any_user
+def match_recipes():
+    # each ingredient only counts once however many times (or in whatever case) it is sent, the coverage below is worked out from this list
+    names = list(
+        dict.fromkeys(
+            name.strip().lower()
+            for name in request.args.getlist("ingredient")
+            if name.strip()
         )
-        #  if it finds a recipe that is similar return it will return it
-        if recipes_by_name:
-            return recipes_schema.dump(recipes_by_name), 200
-        # simple error msg if it cant find a similar recipe
-        else:
-            return {"Error": f"No recipes with the title '{title}' found."}, 404
+    )
+    if not names:
+        return {"Error": "Please provide at least one 'ingredient'."}, 400
+    require_all = request.args.get("all", "").lower() in ("1", "true", "yes")
+
+    # turn the names into ingredient ids with one query
+    stmt = db.select(Ingredient.id, Ingredient.name).filter(
+        func.lower(Ingredient.name).in_(names)
+    )
+    ingredients = db.session.execute(stmt).all()
+    found = {name.lower() for ingredient_id, name in ingredients}
+    unknown = [name for name in names if name not in found]
+
+    # the ranking comes straight out of the in memory index, the database is only asked for the recipes on this page
+    matches = recipe_index.match(
+        [ingredient_id for ingredient_id, name in ingredients], require_all=require_all
+    )
+    if unknown and require_all:
+        matches = []
+    limit = page_limit()
+    allergy_filter = exclude_allergies_filter(excluded_allergies())
+    fields = recipe_fields()
+    serializer = recipe_serializer_for(fields)
+
+    results = []
+    # load the ranked recipes a page at a time until the page is full, recipes can drop out because of the allergy filter or because another process deleted them since the index was built
+    for start in range(0, len(matches), limit):
+        chunk = matches[start : start + limit]
+        stmt = select_recipes(fields).filter(
+            Recipe.id.in_([match[0] for match in chunk])
+        )
+        if allergy_filter is not None:
+            stmt = stmt.filter(allergy_filter)
+        recipes = {recipe.id: recipe for recipe in db.session.scalars(stmt).unique()}
+
+        for recipe_id, matched, missing in chunk:
+            if recipe_id not in recipes:
+                continue
+            result = serializer.dump(recipes[recipe_id])
+            result["matched"] = matched
+            result["missing"] = missing
+            result["coverage"] = round(matched / len(names), 3)
+            results.append(result)
+        if len(results) >= limit:
+            break
+
+    if not results:
+        return {"Error": "No recipes use those ingredients.", "unknown": unknown}, 404
+    return {"data": results[:limit], "unknown": unknown}, 200
 
 
 # -------------------------------------------------------------------
 # -------------------------------------------------------------------
 # CRUD - UPDATE
-# i first tried to check if each ingredient existed but gave up trying to make it work and decide to delete each ingredient and allergy. then create a new instance from the data that is passed through the request.
+# i first tried to check if each ingredient existed but gave up and deleted every ingredient and allergy then created them again, the update now works out what changed instead (see Functions/Recipe_functions.py)
 
 
 # pass the recipe id as an argument
@@ -243,67 +335,40 @@ def update_recipe(recipe_id):
             recipe.serving_size = body_data.get("serving_size") or recipe.serving_size
             recipe.instructions = body_data.get("instructions") or recipe.instructions
 
-            # get the json data for ingredients which in our case is a list of dictonaries
-            ingredients_data = body_data.get("ingredients")
-
-            # delete the current recipeIngredients for the recipe
-            db.session.query(RecipeIngredient).filter_by(recipe_id=recipe_id).delete()
-
-            # Check if ingredients exist and add them if not
-            if ingredients_data:
-                for ingredient_data in ingredients_data:
-                    ingredient_name = ingredient_data.get("ingredient", {}).get("name")
-                    amount = ingredient_data.get("amount")
-                    # check if ingredient exist in database
-                    ingredient = Ingredient.query.filter_by(
-                        name=ingredient_name
-                    ).first()
-                    # if it doesn't we create a new instance of the ingredient
-                    if not ingredient:
-                        ingredient = Ingredient(name=ingredient_name)
-                        db.session.add(ingredient)
-                        db.session.commit()
-
-                    # Create RecipeIngredient instance this will not exist as we are creating this recipe_ingredient relation for the first time
-                    recipe_ingredient = RecipeIngredient(
-                        recipe_id=recipe.id, ingredient=ingredient, amount=amount
-                    )
-
-                    db.session.add(recipe_ingredient)
-                    db.session.commit()
-
-            # same implementation as above delete all the current recipeallergy relations then create a new instance for each
-            allergy_data = body_data.get("allergies")
-
-            db.session.query(RecipeAllergy).filter_by(recipe_id=recipe_id).delete()
-
-            if allergy_data:
-                # create a loop to add each new instance
-                for allergy in allergy_data:
-                    # first check if the allergy exists
-                    exists = db.session.query(Allergy).filter_by(name=allergy).first()
-                    # if it doesn't exist we create a new instance
-                    new = Allergy(name=allergy)
-
-                    if not exists:
-                        db.session.add(new)
-                        db.session.commit()
-
-                    # creating the new recipeallergy instance
-                    recipe_allergy = RecipeAllergy(
-                        recipe_id=recipe_id, allergy_id=exists.id
-                    )
-                    db.session.add(recipe_allergy)
-                    db.session.commit()
+            # only touch the relations the request actually sent, a PATCH with just a title leaves the ingredients and allergies alone. When they are sent only the rows that are different get inserted, updated or deleted.
+            ingredient_ids = None
+            if "ingredients" in body_data:
+                ingredient_ids = sync_recipe_ingredients(
+                    recipe_id, body_data.get("ingredients")
+                )
+            if "allergies" in body_data:
+                allergy_ids = sync_recipe_allergies(
+                    recipe_id, body_data.get("allergies")
+                )
+                recipe.allergy_mask = allergy_mask(allergy_ids)
+            # the relation rows are written with bulk statements that don't go through the recipe, so bump its version by hand for the ETag
+            if "ingredients" in body_data or "allergies" in body_data:
+                touch(recipe)
+
+            # one commit for the whole update
+            db.session.commit()
+
+            # update the recipe's ingredients in the ingredient index if they changed
+            if ingredient_ids is not None:
+                recipe_index.set_recipe(recipe_id, ingredient_ids)
+
             # recipe the updated recipe to the user with code 200
             return {"message": f"Recipe {recipe_id} was successfully updated"}, 200
         else:
             return {"error": f"Recipe with id '{recipe_id}' not found"}, 404
 
     except DataError as err:
+        # undo anything from this request that was already sent to the database
+        db.session.rollback()
         return {"error": str(err)}, 400
 
     except IntegrityError as err:
+        db.session.rollback()
         if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
             return {"error": f"The {err.orig.diag.column_name} is required"}, 400
         if err.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
@@ -339,6 +404,9 @@ def delete_recipe(recipe_id):
         db.session.delete(recipe)
         db.session.commit()
 
+        # and take it out of the ingredient index
+        recipe_index.remove_recipe(recipe_id)
+
         # return simple message to the user with 204 code for successfully deletion
         return {"message": f"recipe with id {recipe_id} was successfully deleted"}, 204
 
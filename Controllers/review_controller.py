@@ -5,8 +5,21 @@ from psycopg2 import errorcodes
 from Models.recipe import Recipe
 
 from Functions.Decorator_functions import user_owner, any_user
+from Functions.Query_functions import (
+    select_reviews,
+    keyset_page,
+    page_response,
+    export_response,
+)
+from Functions.Cache_functions import etag, reviews_fingerprint
+from Functions.Rating_functions import adjust_rating
 from init import db
-from Models.review import Review, review_schema, reviews_schema
+from Models.review import (
+    Review,
+    review_schema,
+    review_serializer,
+    reviews_serializer,
+)
 
 review_bp = Blueprint("review", __name__, url_prefix="/review")
 
@@ -38,6 +51,8 @@ def create_review(recipe_id):
         )
 
         db.session.add(new_review)
+        # add the rating to the recipe's totals in the same transaction
+        adjust_rating(recipe_id, 1, new_review.rating)
         db.session.commit()
 
         return {
@@ -45,9 +60,11 @@ def create_review(recipe_id):
         }, 201
 
     except IntegrityError as err:
+        db.session.rollback()
         if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
             return {"error": f"The {err.orig.diag.column_name} is required"}, 400
     except DataError as err:
+        db.session.rollback()
         if err.orig.pgcode == errorcodes.ZERO_LENGTH_CHARACTER_STRING:
             return {
                 "error": f"One or more fields are the wrong data type please refer to the schema"
@@ -63,41 +80,47 @@ def create_review(recipe_id):
 @jwt_required()
 @any_user
 def get_all_reviews():
-    # query database for all of the reviews and return them to the user
-    reviews = db.select(Review)
-    stmt = db.session.scalars(reviews)
-    return reviews_schema.dump(stmt), 200
+    # query database for one page of reviews ordered by when they were created and return them to the user
+    stmt = select_reviews()
+    reviews, next_cursor = keyset_page(
+        stmt, [(Review.created, False), (Review.id, False)]
+    )
+    return page_response(reviews_serializer.dump(reviews), next_cursor), 200
 
 
-@review_bp.route("/<int:recipe_id>")
+# Stream every review as newline delimited json
+@review_bp.route("/export")
 @jwt_required()
 @any_user
-def get_review_by_recipe(recipe_id):
-    # check for query parameters
-    highest = request.args.get("highest")
-    newest = request.args.get("newest")
+def export_reviews():
+    return export_response(select_reviews(), review_serializer, Review.id)
 
-    # query database to find the target recipe return all of the recipes
-    query = db.session.query(Review).filter_by(recipe_id=recipe_id).all()
 
-    if not query:
+@review_bp.route("/<int:recipe_id>")
+@jwt_required()
+@any_user
+@etag(reviews_fingerprint)
+def get_review_by_recipe(recipe_id):
+    # check for query parameters, ?highest orders by rating (newest first for equal ratings) and ?newest by date
+    if "highest" in request.args:
+        keys = [(Review.rating, True), (Review.created, True), (Review.id, True)]
+    elif "newest" in request.args:
+        keys = [(Review.created, True), (Review.id, True)]
+    else:
+        keys = [(Review.created, False), (Review.id, False)]
+
+    # the sorting and paging are done by the database (using the reviews recipe_id, rating, created index) so only one page of reviews is ever loaded, with their user and recipe joined in
+    stmt = select_reviews().filter(Review.recipe_id == recipe_id)
+    reviews, next_cursor = keyset_page(stmt, keys)
+
+    # an empty page is either a recipe without reviews or a recipe that doesn't exist
+    if not reviews and not db.session.scalar(
+        db.select(Recipe.id).filter_by(id=recipe_id)
+    ):
         return {"error": f"recipe with id {recipe_id} couldn't be found"}, 404
 
-    # check if the highest parameter exists
-    if highest:
-        # creating the logic to order the reviews from highest to lowest rating
-        query = query.order_by(Review.rating.desc())
-
-    # check if newest exists
-    if newest:
-        # creating logic to order the data from newest to oldest
-        query = query.order_by(Review.created.desc())
-
-    # declares that the reviews in equal to all of the reviews we retrieved from the database
-    reviews = query.all()
-
     # return the reviews to the user
-    return reviews_schema.dump(reviews), 200
+    return page_response(reviews_serializer.dump(reviews), next_cursor), 200
 
 
 # -------------------------------------------------------------------
@@ -117,9 +140,13 @@ def update_review(review_id):
     # if we cant find the review by id
     if not review:
         return {"error": f"Review with id {review_id} couldn't be found"}, 404
+    old_rating = review.rating
     review.details = body_data.get("details") or review.details
     review.rating = body_data.get("rating") or review.rating
 
+    # only the sum (and so the average) changes when a rating is edited
+    if review.rating != old_rating:
+        adjust_rating(review.recipe_id, 0, review.rating - old_rating)
     db.session.commit()
     return {"message": f"Review with id {review_id} successfully updated"}, 200
 
@@ -134,13 +161,14 @@ def update_review(review_id):
 @user_owner
 def delete_review(review_id):
     # Query database to find the target review
-    review = db.select(Review).filter_by(id=review_id).first()
+    review = db.session.scalar(db.select(Review).filter_by(id=review_id))
 
     # if the review doesn't exist send an error to the user
     if not review:
         return {"error": f"Review with id {review_id} couldn't be found"}, 404
 
-    # delete the review
+    # delete the review and take its rating off the recipe's totals
+    adjust_rating(review.recipe_id, -1, -review.rating)
     db.session.delete(review)
     db.session.commit()
 
@@ -5,8 +5,17 @@ from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import create_access_token, jwt_required
 from psycopg2 import errorcodes
 
-from Functions.Decorator_functions import authorise_as_admin, user_owner
-from init import db, bcrypt
+from Functions.Decorator_functions import (
+    authorise_as_admin,
+    user_owner,
+    invalidate_auth_user,
+)
+from Functions.Limiter_functions import login_limiter
+from Functions.Password_functions import passwords
+from Functions.Query_functions import keyset_page, page_response
+from Functions.Rating_functions import refresh_ratings
+from init import db
+from Models.review import Review
 from Models.user import User, user_schema, users_schema
 
 db_auth = Blueprint("auth", __name__, url_prefix="/auth")
@@ -32,9 +41,9 @@ def auth_register():
 
         # password from the request body
         password = body_data.get("password")
-        # if password exists, hash the password
+        # if password exists, hash the password (in the password pool, see Functions/Password_functions.py)
         if password:
-            user.password = bcrypt.generate_password_hash(password).decode("utf-8")
+            user.password = passwords.hash(password)
 
         # add and commit the user to DB
         db.session.add(user)
@@ -51,6 +60,7 @@ def auth_register():
 
 
 @db_auth.route("/login", methods=["POST"])  # /auth/login
+@login_limiter.limit
 def auth_login():
     try:
         # get the data from the request body
@@ -60,12 +70,24 @@ def auth_login():
         stmt = db.select(User).filter_by(email=body_data.get("email"))
         user = db.session.scalar(stmt)
         # If user exists and password is correct
-        if user and bcrypt.check_password_hash(
-            user.password, body_data.get("password")
-        ):
+        password_correct = False
+        if user:
+            password_correct, new_hash = passwords.check(
+                user.password, body_data.get("password")
+            )
+            # the password was hashed at a different BCRYPT_LOG_ROUNDS, keep the new hash
+            if new_hash:
+                user.password = new_hash
+                db.session.commit()
+        else:
+            # as slow as a wrong password so the timing doesn't give away which emails are registered
+            passwords.check_missing_user(body_data.get("password"))
+        if password_correct:
             # creates a JWT token i set the timedelta to 21 days so i didn't have to login my user in everytime i wanted to test an endpoint
             token = create_access_token(
-                identity=str(user.id), expires_delta=timedelta(days=21)
+                identity=str(user.id),
+                expires_delta=timedelta(days=21),
+                additional_claims={"is_admin": bool(user.is_admin)},
             )
             # return the token along with the user info
             return {"email": user.email, "token": token, "is_admin": user.is_admin}
@@ -93,12 +115,12 @@ def auth_login():
 def get_all_users():
     # queries the database from all the rows in the table user returns all the data on each user
     stmt = db.select(User)
-    users = db.session.scalars(stmt)
+    users, next_cursor = keyset_page(stmt, [(User.id, False)])
     # if no users exist we send an error
     if not users:
         return {"error": "no users could be found"}, 404
-    # return the users
-    return users_schema.dump(users)
+    # return the page of users
+    return page_response(users_schema.dump(users), next_cursor)
 
 
 @db_auth.route("/user/<int:user_id>")
@@ -131,7 +153,7 @@ def user_update(user_id):
         user = db.session.scalar(stmt)
         password = body_data.get("password")
         if password:
-            password = bcrypt.generate_password_hash(password).decode("utf-8")
+            password = passwords.hash(password)
             db.session.commit()
         if user:
             user.name = body_data.get("name") or user.name
@@ -139,6 +161,8 @@ def user_update(user_id):
             user.password = password or user.password
             user.is_admin = body_data.get("is_admin") or user.is_admin
             db.session.commit()
+            # the authorization decorators may have this user cached
+            invalidate_auth_user(user_id)
             return user_schema.dump(user)
         else:
             # return error msg
@@ -166,7 +190,16 @@ def delete_user(user_id):
     # if the user cannot be found give an error
     if not user:
         return {"error": f"User with id {user_id} couldn't be found"}, 404
+    # the user's reviews are deleted with them, so the rating totals of the recipes they reviewed are worked out again in the same transaction
+    reviewed = db.session.scalars(
+        db.select(Review.recipe_id).filter_by(user_id=user_id).distinct()
+    ).all()
     db.session.delete(user)
+    db.session.flush()
+    if reviewed:
+        refresh_ratings(reviewed)
     db.session.commit()
+    # make sure the deleted user's token stops working straight away
+    invalidate_auth_user(user_id)
     # user successfully deleted
     return {"message": f"User with id {user_id} successfully deleted"}, 200
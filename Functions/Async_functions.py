@@ -0,0 +1,151 @@
+import io
+import os
+import sys
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from init import db
+from Functions.Config_functions import async_database_uri, async_engine_options
+from Functions.Profiler_functions import profiler
+
+# ASGI mode ("python serve.py --async"). The read endpoints below run on an asyncio event loop with an async database driver (asyncpg), so while one request waits on postgres the same thread carries on with other requests instead of every waiting request holding a whole thread.
+# They are the same flask views as always. Each request gets a normal flask request context and its db.session is swapped for the sync side of an AsyncSession, SQLAlchemy runs the view in a greenlet and every query inside it is awaited on the event loop. The decorators, schemas, paging, ETags and response cache all work unchanged.
+# Everything else (writes, logins, the streaming exports) goes to the normal WSGI app on a thread pool.
+# A view that holds a threading lock while it queries the database can't go on the list, the lock would block the whole event loop while another request on it waits for the same lock (recipes.match_recipes builds its index like that).
+ASYNC_ENDPOINTS = {
+    "recipes.get_all_recipes",
+    "recipes.get_recipe",
+    "recipes.get_recipes_batch",
+    "recipes.get_recipe_by_ingredient",
+    "review.get_all_reviews",
+    "review.get_review_by_recipe",
+    "ingredient.get_ingredient",
+    "allergy.get_ingredient",
+}
+
+
+def build_environ(scope, body=b""):
+    # the WSGI environ flask expects, made from an ASGI http scope
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin1"),
+        "PATH_INFO": scope["path"].encode().decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    server, port = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"] = server
+    environ["SERVER_PORT"] = str(port or 80)
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = (
+            scope["client"][0],
+            str(scope["client"][1]),
+        )
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class AsyncReadApp:
+    def __init__(self, app):
+        self.app = app
+        self.endpoints = set(app.config.get("ASYNC_ENDPOINTS", ASYNC_ENDPOINTS))
+        # the threads that run the rest of the api
+        self.wsgi = WSGIMiddleware(
+            app, workers=app.config.get("ASYNC_WSGI_THREADS", 10)
+        )
+        self._engine = None
+        self._pid = None
+
+    @property
+    def engine(self):
+        # made in the worker process on first use, an engine (and its connections) can't be shared with the process it was forked from
+        if self._pid != os.getpid():
+            self._engine = create_async_engine(
+                async_database_uri(self.app.config["SQLALCHEMY_DATABASE_URI"]),
+                **async_engine_options(self.app),
+            )
+            self._pid = os.getpid()
+            profiler.watch_engine(self._engine.sync_engine)
+        return self._engine
+
+    def _endpoint(self, environ):
+        adapter = self.app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, view_args = adapter.match()
+        except (HTTPException, RequestRedirect):
+            # 404s, 405s and redirects are left to the WSGI app to answer
+            return None
+        return endpoint
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._engine is not None and self._pid == os.getpid():
+                    await self._engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            return await self.wsgi(scope, receive, send)
+        environ = build_environ(scope)
+        if self._endpoint(environ) not in self.endpoints:
+            return await self.wsgi(scope, receive, send)
+
+        async with AsyncSession(self.engine) as session:
+            status, headers, body = await session.run_sync(self._dispatch, environ)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (name.lower().encode("latin1"), value.encode("latin1"))
+                    for name, value in headers
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b"" if scope["method"] == "HEAD" else body,
+            }
+        )
+
+    def _dispatch(self, sync_session, environ):
+        # runs in SQLAlchemy's greenlet, the same steps as Flask.wsgi_app with db.session pointed at the async session. The WSGI middleware (ProxyFix) is skipped, none of these endpoints look at the client address
+        ctx = self.app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                db.session.registry.set(sync_session)
+                response = self.app.full_dispatch_request()
+            except Exception as err:
+                error = err
+                response = self.app.handle_exception(err)
+            return (
+                response.status_code,
+                response.headers.to_wsgi_list(),
+                response.get_data(),
+            )
+        finally:
+            ctx.pop(error)
@@ -0,0 +1,315 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, current_app, request
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+from init import db
+from Models.recipe import Recipe
+from Models.review import Review
+from Models.ingredient import Ingredient
+from Models.allergy import Allergy
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+from Models.user import User
+
+# Server side cache for the recipe read endpoints. The finished JSON bytes are stored so a hit skips the database and marshmallow completely.
+# Instead of working out which keys a write affects, every key includes a "generation" number and any commit that touches a table the recipes are built from bumps it, so every older entry is simply never asked for again (the LRU or the redis TTL clears them out).
+# The memory backend is per process, a commit only bumps the generation in the worker that made it and the other workers would keep serving the old responses until they expire. So it is only allowed with a single process, with several worker processes (or APP_ENV=production) use the redis backend, it keeps the generation in redis so a commit in one worker invalidates the cache for all of them.
+
+# a recipe response includes its author, reviews (and their authors), ingredients and allergies so a write to any of these tables makes cached recipes stale
+CACHED_MODELS = (
+    Recipe,
+    Review,
+    Ingredient,
+    Allergy,
+    RecipeIngredient,
+    RecipeAllergy,
+    User,
+)
+
+
+class MemoryBackend:
+    # least recently used cache, when it is full the entry that hasn't been read for the longest is dropped
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+            # nothing can read the old entries anymore so free the memory now
+            self._entries.clear()
+
+
+class RedisBackend:
+    # works with redis or anything that speaks its protocol, the redis package is only needed when this backend is picked
+    GENERATION_KEY = "response-cache:generation"
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def generation(self):
+        return int(self.client.get(self.GENERATION_KEY) or 0)
+
+    def bump_generation(self):
+        self.client.incr(self.GENERATION_KEY)
+
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.ttl = 60
+
+    def init_app(self, app):
+        backend = app.config.get("CACHE_BACKEND", "memory")
+        self.ttl = app.config.get("CACHE_TTL", 60)
+        if backend == "redis":
+            self.backend = RedisBackend(app.config["CACHE_REDIS_URL"])
+        elif backend == "memory":
+            if (
+                app.config.get("WORKER_PROCESSES", 1) > 1
+                or app.config.get("APP_ENV") == "production"
+            ):
+                raise RuntimeError(
+                    "CACHE_BACKEND=memory only works with one process, the other "
+                    "workers would serve stale responses after a write. Use "
+                    "CACHE_BACKEND=redis or CACHE_BACKEND=none"
+                )
+            self.backend = MemoryBackend(app.config.get("CACHE_MAX_ENTRIES", 1024))
+        else:
+            # "none" turns the cache off
+            self.backend = None
+
+    def invalidate(self):
+        if self.backend is not None:
+            self.backend.bump_generation()
+
+    def cached(self, fn):
+        # goes under the auth decorators so only authorised requests get a cached response
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.backend is None:
+                return fn(*args, **kwargs)
+
+            params = "&".join(
+                f"{key}={value}"
+                for key, value in sorted(request.args.items(multi=True))
+            )
+            view_args = ",".join(
+                f"{key}={value}" for key, value in sorted(kwargs.items())
+            )
+            key = f"response:{self.backend.generation()}:{request.endpoint}:{view_args}?{params}"
+
+            body = self.backend.get(key)
+            if body is not None:
+                response = Response(body, status=200, mimetype="application/json")
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            response = current_app.make_response(fn(*args, **kwargs))
+            # only successful responses are worth keeping
+            if response.status_code == 200:
+                self.backend.set(key, response.get_data(), self.ttl)
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+
+response_cache = ResponseCache()
+
+
+# the session events below are how writes invalidate the cache. A flush or a bulk insert/update/delete that touches one of the cached tables marks the session, and once that transaction commits the generation is bumped. A rollback just clears the mark.
+def _mark_session(session):
+    session.info["response_cache_stale"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, CACHED_MODELS):
+            _mark_session(session)
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _after_bulk_write(orm_execute_state):
+    # covers session.execute(insert/update/delete(...)), query(...).delete() and raw text() statements that write
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or issubclass(mapper.class_, CACHED_MODELS):
+        _mark_session(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("response_cache_stale", False):
+        response_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("response_cache_stale", None)
+
+
+# ETags. Every row a response is built from has a version number that goes up whenever the row changes, so a cheap aggregate over those versions (no relationships loaded, nothing serialized) tells us if the response would be different. When it matches the ETag the client already has we send back an empty 304.
+VERSIONED_MODELS = (Recipe, Review, Ingredient, Allergy, User)
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_versions(session, flush_context, instances):
+    for instance in session.dirty:
+        if not isinstance(instance, VERSIONED_MODELS):
+            continue
+        if not session.is_modified(instance, include_collections=False):
+            continue
+        # leave it alone if the code already bumped it by hand
+        if not inspect(instance).attrs.version.history.has_changes():
+            # done in SQL so two requests updating the same row can't both write the same number
+            instance.version = type(instance).version + 1
+
+
+def touch(instance):
+    # for changes the row itself doesn't see, like a recipe's ingredient amounts changing
+    instance.version = type(instance).version + 1
+
+
+def etag(fingerprint):
+    # fingerprint(**view_args) returns a tuple that changes whenever the response would, or None when there is nothing to tag (the handler then returns its own 404)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            values = fingerprint(**kwargs)
+            if values is None:
+                return fn(*args, **kwargs)
+
+            # the query parameters change the response too so they are part of the tag
+            tag = hashlib.sha1(
+                repr(
+                    (
+                        request.endpoint,
+                        sorted(kwargs.items()),
+                        sorted(request.args.items(multi=True)),
+                        tuple(values),
+                    )
+                ).encode()
+            ).hexdigest()
+
+            if request.if_none_match.contains(tag):
+                response = Response(status=304)
+                response.set_etag(tag)
+                return response
+
+            response = current_app.make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(tag)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def table_fingerprint(model):
+    # for whole table listings, the row count and highest id change on inserts and deletes and the sum of the versions changes on every update
+    stmt = db.select(
+        func.count(model.id),
+        func.coalesce(func.max(model.id), 0),
+        func.coalesce(func.sum(model.version), 0),
+    )
+    return tuple(db.session.execute(stmt).one())
+
+
+def reviews_fingerprint(recipe_id):
+    # the reviews of one recipe including their authors (name and email are in the response) and the recipe's title
+    recipe_version = (
+        db.select(Recipe.version).filter(Recipe.id == recipe_id).scalar_subquery()
+    )
+    stmt = (
+        db.select(
+            recipe_version,
+            func.count(Review.id),
+            func.coalesce(func.max(Review.id), 0),
+            func.coalesce(func.sum(Review.version), 0),
+            func.coalesce(func.sum(User.version), 0),
+        )
+        .join(User, Review.user_id == User.id)
+        .filter(Review.recipe_id == recipe_id)
+    )
+    return tuple(db.session.execute(stmt).one())
+
+
+def recipe_fingerprint(recipe_id):
+    # one query with a subquery per relation the recipe response embeds, plus the reviews query
+    ingredients = (
+        db.select(
+            func.count(RecipeIngredient.id).label("count"),
+            func.coalesce(func.sum(Ingredient.version), 0).label("versions"),
+        )
+        .join(Ingredient)
+        .filter(RecipeIngredient.recipe_id == recipe_id)
+        .subquery()
+    )
+    allergies = (
+        db.select(
+            func.count(RecipeAllergy.id).label("count"),
+            func.coalesce(func.sum(Allergy.version), 0).label("versions"),
+        )
+        .join(Allergy)
+        .filter(RecipeAllergy.recipe_id == recipe_id)
+        .subquery()
+    )
+    stmt = (
+        db.select(
+            Recipe.version,
+            User.version,
+            ingredients.c.count,
+            ingredients.c.versions,
+            allergies.c.count,
+            allergies.c.versions,
+        )
+        .join(User, Recipe.user_id == User.id)
+        .join(ingredients, db.true())
+        .join(allergies, db.true())
+        .filter(Recipe.id == recipe_id)
+    )
+    row = db.session.execute(stmt).first()
+    if row is None:
+        return None
+    return tuple(row) + reviews_fingerprint(recipe_id)
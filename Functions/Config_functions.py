@@ -0,0 +1,113 @@
+import os
+from sqlalchemy.engine import make_url
+
+# Settings for running in production (APP_ENV=production). Every worker process gets its own connection pool, so the pool is sized from how many workers and threads gunicorn runs (WEB_CONCURRENCY and WEB_THREADS, the same variables gunicorn.conf.py reads) so that all the workers together stay inside the connections postgres allows (DB_MAX_CONNECTIONS).
+# Any of the values can be set directly with the DB_* variables below, or with a python config file passed in APP_CONFIG_FILE which is loaded last and wins.
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    return value.lower() == "true" if value not in (None, "") else default
+
+
+def worker_count():
+    return env_int("WEB_CONCURRENCY", 2)
+
+
+def thread_count():
+    return env_int("WEB_THREADS", 4)
+
+
+def production_engine_options(uri, workers=None, threads=None):
+    if not uri or make_url(uri).get_backend_name() == "sqlite":
+        # sqlite has no server to share connections with
+        return {"pool_pre_ping": True}
+
+    workers = workers or worker_count()
+    threads = threads or thread_count()
+    # leave a few connections spare for migrations, psql and the cli commands
+    budget = max(
+        1, env_int("DB_MAX_CONNECTIONS", 100) - env_int("DB_RESERVED_CONNECTIONS", 5)
+    )
+    per_worker = max(1, budget // workers)
+    # one connection per thread, anything left over is overflow for short bursts
+    pool_size = env_int("DB_POOL_SIZE", min(threads, per_worker))
+    max_overflow = env_int("DB_MAX_OVERFLOW", max(0, per_worker - pool_size))
+
+    options = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        # a request waiting longer than this for a connection fails instead of hanging the thread
+        "pool_timeout": env_int("DB_POOL_TIMEOUT", 10),
+        # reconnect before the server or a proxy times an idle connection out
+        "pool_recycle": env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": env_bool("DB_POOL_PRE_PING", True),
+        # reuse the most recent connection so the rest can go idle and be recycled
+        "pool_use_lifo": True,
+    }
+
+    if make_url(uri).get_backend_name() == "postgresql":
+        # statement_timeout is in milliseconds, 0 turns it off
+        server_options = (
+            f"-c statement_timeout={env_int('DB_STATEMENT_TIMEOUT', 30000)}"
+        )
+        options["connect_args"] = {
+            "connect_timeout": env_int("DB_CONNECT_TIMEOUT", 5),
+            "application_name": os.environ.get("DB_APPLICATION_NAME", "recipe_api"),
+            "options": server_options,
+            # notice dead connections (a failed over database) without waiting for the os default of hours
+            "keepalives": 1,
+            "keepalives_idle": 30,
+            "keepalives_interval": 10,
+            "keepalives_count": 3,
+        }
+    return options
+
+
+def configure_production(app):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = production_engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"]
+    )
+
+
+# the async drivers for ASGI mode (asyncpg, and aiosqlite for local sqlite databases)
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def async_database_uri(uri):
+    url = make_url(os.environ.get("ASYNC_DATABASE_URI") or uri)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url
+
+
+def async_engine_options(app):
+    # the same pool settings as the sync engine, asyncpg takes its connection settings in a different shape to psycopg2
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    options.pop("poolclass", None)
+    connect_args = options.pop("connect_args", None)
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if make_url(uri).get_backend_name() == "postgresql":
+        # one event loop serves every request of the worker so its pool takes the whole per worker budget instead of one connection per thread
+        budget = max(
+            1,
+            env_int("DB_MAX_CONNECTIONS", 100) - env_int("DB_RESERVED_CONNECTIONS", 5),
+        )
+        per_worker = max(1, budget // worker_count())
+        options["pool_size"] = env_int("DB_ASYNC_POOL_SIZE", per_worker)
+        options["max_overflow"] = 0
+        if connect_args:
+            options["connect_args"] = {
+                "timeout": connect_args["connect_timeout"],
+                "server_settings": {
+                    "application_name": connect_args["application_name"],
+                    "statement_timeout": str(env_int("DB_STATEMENT_TIMEOUT", 30000)),
+                },
+            }
+    return options
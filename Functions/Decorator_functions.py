@@ -1,16 +1,69 @@
 import functools
+import threading
+import time
+from collections import namedtuple
+from flask import current_app, g
 from Models.user import User
 from init import db
-from flask_jwt_extended import get_jwt_identity
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+# The decorators only need to know if the user in the token still exists and if they are an admin, so that is all that gets loaded. It is looked up once per request (and stored on flask.g so the handler can use it too) and kept in a small process wide cache for AUTH_CACHE_TTL seconds so busy clients don't hit the users table on every request.
+AuthUser = namedtuple("AuthUser", ["id", "is_admin"])
+
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+
+
+def invalidate_auth_user(user_id):
+    # call this whenever a user is updated or deleted so the change applies straight away in this process
+    with _auth_cache_lock:
+        _auth_cache.pop(int(user_id), None)
+
+
+def current_auth_user():
+    # returns the AuthUser for the token on this request, or None if they no longer exist
+    if "auth_user" in g:
+        return g.auth_user
+
+    user_id = int(get_jwt_identity())
+    ttl = current_app.config.get("AUTH_CACHE_TTL", 0)
+    now = time.monotonic()
+
+    with _auth_cache_lock:
+        cached = _auth_cache.get(user_id)
+    if cached and cached[0] > now:
+        auth_user = cached[1]
+    else:
+        stmt = db.select(User.id, User.is_admin).filter_by(id=user_id)
+        row = db.session.execute(stmt).first()
+        auth_user = AuthUser(row.id, bool(row.is_admin)) if row else None
+        if ttl:
+            with _auth_cache_lock:
+                _auth_cache[user_id] = (now + ttl, auth_user)
+
+    g.auth_user = auth_user
+    return auth_user
+
+
+def token_is_admin():
+    # when JWT_TRUST_ADMIN_CLAIM is turned on the is_admin claim added at login is trusted so admin checks don't need the database at all. It stays off by default because a token keeps its claim until it expires even if the user is demoted.
+    if current_app.config.get("JWT_TRUST_ADMIN_CLAIM"):
+        return get_jwt().get("is_admin")
+    return None
 
 
 # this decorator is used when an action can ONLY be performed by an administator
 def authorise_as_admin(fn):
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        stmt = db.select(User).filter_by(id=user_id)
-        user = db.session.scalar(stmt)
+        # the token can answer this on its own if we trust its admin claim
+        claim = token_is_admin()
+        if claim is not None:
+            if claim:
+                return fn(*args, **kwargs)
+            return {"error": "Not authorised to request this"}, 403
+
+        user = current_auth_user()
 
         # If the user is not found
         if not user:
@@ -34,8 +87,7 @@ def authorise_as_admin(fn):
 def user_owner(fn):
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = db.session.query(User).filter_by(id=user_id).first()
+        user = current_auth_user()
 
         # If the user is not found
         if not user:
@@ -55,8 +107,7 @@ def user_owner(fn):
 def any_user(fn):
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = db.session.query(User).filter_by(id=user_id).first()
+        user = current_auth_user()
 
         # If the user is not found
         if not user:
@@ -0,0 +1,175 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from sqlalchemy import BigInteger, and_, distinct, func, literal
+from init import db
+from Models.recipe import Recipe
+from Models.allergy import Allergy
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+
+# In memory inverted index from an ingredient id to the sorted ids of every recipe that uses it. Answering "which recipes use these ingredients" then becomes merging a few small sorted arrays in python instead of running a join per ingredient.
+# Each process keeps its own copy, the recipe handlers keep it up to date for their own writes and it is rebuilt from the database every REFRESH_SECONDS so writes made by other worker processes show up as well.
+REFRESH_SECONDS = 300
+
+
+class RecipeIngredientIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ingredient_id -> array of recipe ids kept in sorted order
+        self._postings = {}
+        # recipe_id -> tuple of ingredient ids, needed to undo a recipe when it changes
+        self._recipes = {}
+        self._built_at = None
+
+    def _build(self):
+        stmt = db.select(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id)
+        recipes = {}
+        for recipe_id, ingredient_id in db.session.execute(stmt):
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+
+        postings = {}
+        # going through the recipes in id order means every array is appended to in sorted order
+        for recipe_id in sorted(recipes):
+            for ingredient_id in recipes[recipe_id]:
+                postings.setdefault(ingredient_id, array("l")).append(recipe_id)
+
+        self._postings = postings
+        self._recipes = {
+            recipe_id: tuple(ingredients) for recipe_id, ingredients in recipes.items()
+        }
+        self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        if (
+            self._built_at is None
+            or time.monotonic() - self._built_at > REFRESH_SECONDS
+        ):
+            self._build()
+
+    def _remove(self, recipe_id):
+        for ingredient_id in self._recipes.pop(recipe_id, ()):
+            posting = self._postings[ingredient_id]
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+            if not posting:
+                del self._postings[ingredient_id]
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        # called by the recipe handlers after a recipe's ingredients are committed
+        with self._lock:
+            if self._built_at is None:
+                # nothing to update yet, the first search will build the whole index
+                return
+            self._remove(recipe_id)
+            ingredient_ids = tuple(set(ingredient_ids))
+            if ingredient_ids:
+                self._recipes[recipe_id] = ingredient_ids
+            for ingredient_id in ingredient_ids:
+                posting = self._postings.setdefault(ingredient_id, array("l"))
+                posting.insert(bisect_left(posting, recipe_id), recipe_id)
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            self._remove(recipe_id)
+
+    def match(self, ingredient_ids, require_all=False):
+        # returns (recipe_id, matched, missing) for every recipe using at least one of the ingredients (or all of them when require_all is set), best matches first
+        ingredient_ids = set(ingredient_ids)
+        with self._lock:
+            self._ensure_built()
+            postings = [
+                self._postings.get(ingredient_id, ())
+                for ingredient_id in ingredient_ids
+            ]
+
+            if require_all:
+                # intersect starting from the shortest list so the working set stays small
+                postings.sort(key=len)
+                matches = set(postings[0]) if postings else set()
+                for posting in postings[1:]:
+                    matches.intersection_update(posting)
+                counts = {recipe_id: len(postings) for recipe_id in matches}
+            else:
+                counts = Counter()
+                for posting in postings:
+                    counts.update(posting)
+
+            results = [
+                (recipe_id, matched, len(self._recipes[recipe_id]) - matched)
+                for recipe_id, matched in counts.items()
+            ]
+
+        # most of the requested ingredients used first, then the recipes that need the fewest extra ingredients
+        results.sort(key=lambda result: (-result[1], result[2], result[0]))
+        return results
+
+
+recipe_index = RecipeIngredientIndex()
+
+
+# Allergy bitmasks. Every recipe stores the allergies it contains as bits in recipes.allergy_mask, so "leave out anything with Pork or Dairy" is a single bitwise AND per row instead of a join against recipe_allergy.
+# A BIGINT has room for 63 allergies (the sign bit is left alone), any allergy with a bigger id falls back to a NOT EXISTS check on recipe_allergy.
+MASK_BITS = 63
+
+
+def allergy_bit(allergy_id):
+    if 0 < allergy_id <= MASK_BITS:
+        return 1 << (allergy_id - 1)
+    return 0
+
+
+def allergy_mask(allergy_ids):
+    # the mask for a set of allergy ids, used when the ids are already known
+    mask = 0
+    for allergy_id in allergy_ids:
+        mask |= allergy_bit(allergy_id)
+    return mask
+
+
+def allergy_mask_subquery():
+    # SQL for a recipe's mask built from its recipe_allergy rows, the DISTINCT means a duplicated row can't add the same bit twice
+    bit = literal(1, BigInteger).op("<<")(RecipeAllergy.allergy_id - 1)
+    return (
+        db.select(func.coalesce(func.sum(distinct(bit)), 0))
+        .filter(
+            RecipeAllergy.recipe_id == Recipe.id,
+            RecipeAllergy.allergy_id.between(1, MASK_BITS),
+        )
+        .scalar_subquery()
+    )
+
+
+def refresh_allergy_masks(recipe_id=None):
+    # recalculates the mask for one recipe (after its allergies change) or for every recipe when no id is passed, the caller commits
+    stmt = db.update(Recipe).values(allergy_mask=allergy_mask_subquery())
+    if recipe_id is not None:
+        stmt = stmt.filter(Recipe.id == recipe_id)
+    db.session.execute(stmt, execution_options={"synchronize_session": False})
+
+
+def exclude_allergies_filter(names):
+    # returns a filter that leaves out recipes containing any of the named allergies, or None if none of the names are known allergies
+    names = [name.strip().lower() for name in names if name.strip()]
+    if not names:
+        return None
+    stmt = db.select(Allergy.id).filter(func.lower(Allergy.name).in_(names))
+    allergy_ids = db.session.scalars(stmt).all()
+    if not allergy_ids:
+        return None
+
+    mask = 0
+    overflow = []
+    for allergy_id in allergy_ids:
+        if allergy_bit(allergy_id):
+            mask |= allergy_bit(allergy_id)
+        else:
+            overflow.append(allergy_id)
+
+    conditions = [Recipe.allergy_mask.op("&")(mask) == 0]
+    if overflow:
+        conditions.append(~Recipe.allergies.any(RecipeAllergy.allergy_id.in_(overflow)))
+    return and_(*conditions)
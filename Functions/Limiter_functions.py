@@ -0,0 +1,126 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+
+# Token bucket rate limiting for /auth/login. Every caller IP and every email address has a bucket that holds up to LOGIN_*_BURST attempts and refills at LOGIN_*_PER_MINUTE, each login attempt takes one from both. An empty bucket gets a 429 before the users table is queried or a password is hashed, so a credential stuffing burst costs almost nothing once it is over its budget.
+# The IP bucket is checked first so a caller that is already over their own limit can't use up the attempts of the emails they are trying.
+# The memory store is per process, every worker would have its own buckets and the real limit would be multiplied by the number of workers. So it is only allowed with a single process, with several workers (or APP_ENV=production) the redis store is used so they share one set of buckets (RATELIMIT_BACKEND=redis).
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Too many login attempts, please try again later")
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    # buckets are dropped least recently used first, a dropped bucket is the same as a full one
+    def __init__(self, max_buckets=100_000):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, per_second, burst):
+        # returns 0 if a token was taken, otherwise the seconds until there will be one
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * per_second)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / per_second
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBucketStore:
+    # the same bucket as a lua script so the read and the write happen in one step in redis, the redis package is only needed when this store is picked
+    SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local per_second = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * per_second)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / per_second) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._take = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, per_second, burst):
+        return float(
+            self._take(keys=[f"ratelimit:{key}"], args=[per_second, burst, time.time()])
+        )
+
+
+class LoginLimiter:
+    def __init__(self):
+        self.store = None
+
+    def init_app(self, app):
+        backend = app.config.get("RATELIMIT_BACKEND", "memory")
+        if backend == "redis":
+            self.store = RedisBucketStore(app.config["RATELIMIT_REDIS_URL"])
+        elif backend == "memory":
+            if (
+                app.config.get("WORKER_PROCESSES", 1) > 1
+                or app.config.get("APP_ENV") == "production"
+            ):
+                raise RuntimeError(
+                    "RATELIMIT_BACKEND=memory only works with one process, every "
+                    "worker would keep its own login limits. Use "
+                    "RATELIMIT_BACKEND=redis or RATELIMIT_BACKEND=none"
+                )
+            self.store = MemoryBucketStore()
+        else:
+            # "none" turns the limiter off
+            self.store = None
+        self.ip_rate = app.config.get("LOGIN_IP_PER_MINUTE", 30) / 60
+        self.ip_burst = app.config.get("LOGIN_IP_BURST", 10)
+        self.email_rate = app.config.get("LOGIN_EMAIL_PER_MINUTE", 5) / 60
+        self.email_burst = app.config.get("LOGIN_EMAIL_BURST", 5)
+
+    def check(self, email):
+        if self.store is None:
+            return
+        wait = self.store.take(f"ip:{request.remote_addr}", self.ip_rate, self.ip_burst)
+        if not wait and email:
+            wait = self.store.take(
+                f"email:{email.strip().lower()}", self.email_rate, self.email_burst
+            )
+        if wait:
+            raise RateLimited(max(1, round(wait)))
+
+    def limit(self, fn):
+        # goes on the login route, runs before the body is validated so even malformed attempts count
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            body = request.get_json(silent=True)
+            email = body.get("email") if isinstance(body, dict) else None
+            self.check(email if isinstance(email, str) else None)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+
+login_limiter = LoginLimiter()
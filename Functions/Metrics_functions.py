@@ -0,0 +1,363 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import Pool, QueuePool
+from init import db
+
+# Prometheus metrics for GET /metrics, in the plain text format Prometheus scrapes. Off unless METRICS_ENABLED=true, and the endpoint needs the METRICS_TOKEN (see Controllers/metrics_controller.py).
+# Recording a value never takes a lock: every thread gets its own set of counters (a "shard") the first time it records something, and only reading /metrics adds the shards together. Shards of threads that have finished are folded into one so a server that starts a thread per request doesn't collect them forever.
+# With several worker processes (gunicorn) each process only sees its own requests, so when METRICS_MULTIPROC_DIR is set every process writes its totals to a file in that directory every few seconds and /metrics adds up the files of every process. Counters and histograms of processes that have exited are kept, gauges only count processes that are still running.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+BCRYPT_BUCKETS = (0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1, 2)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "http_requests_total": ("counter", "Requests handled", None),
+    "http_request_duration_seconds": (
+        "histogram",
+        "Time to handle a request",
+        LATENCY_BUCKETS,
+    ),
+    "db_pool_connections_total": ("counter", "Database connections opened", None),
+    "db_pool_checkouts_total": ("counter", "Connections taken from the pool", None),
+    "db_pool_waits_total": (
+        "counter",
+        "Checkouts that had to wait because the pool and its overflow were in use",
+        None,
+    ),
+    "db_pool_wait_seconds": (
+        "histogram",
+        "Time spent waiting for a connection",
+        WAIT_BUCKETS,
+    ),
+    "db_pool_timeouts_total": (
+        "counter",
+        "Checkouts that gave up waiting for a connection",
+        None,
+    ),
+    "db_pool_checked_out": ("gauge", "Connections currently in use", None),
+    "db_pool_overflow": (
+        "gauge",
+        "Connections open above pool_size (negative while the pool is still filling)",
+        None,
+    ),
+    "db_pool_size": ("gauge", "Configured pool_size", None),
+    "bcrypt_seconds": ("histogram", "Time to hash or check a password", BCRYPT_BUCKETS),
+}
+
+
+class Shard:
+    # one thread's counters, only ever written by that thread
+    def __init__(self, thread=None):
+        self.thread = thread
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+
+    def merge(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other.histograms.items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    mine[index] += value
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self._local = threading.local()
+        self._shards = []
+        self._retired = Shard()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushed_at = 0
+        self.directory = None
+        self.flush_seconds = 5
+
+    def init_app(self, app):
+        # has to run before db.init_app so the engine is created with the measured pool
+        self.enabled = app.config.get("METRICS_ENABLED", False)
+        if not self.enabled:
+            return
+        self.directory = app.config.get("METRICS_MULTIPROC_DIR")
+        self.flush_seconds = app.config.get("METRICS_FLUSH_SECONDS", 5)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        # the measured QueuePool times checkouts that have to wait, sqlite picks its own pools so it is left alone
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        uri = app.config.get("SQLALCHEMY_DATABASE_URI")
+        if uri and make_url(uri).get_backend_name() != "sqlite":
+            options.setdefault("poolclass", MeasuredQueuePool)
+
+        # listening on the Pool class covers whatever engine flask-sqlalchemy creates
+        if not event.contains(Pool, "connect", self._pool_connect):
+            event.listen(Pool, "connect", self._pool_connect)
+            event.listen(Pool, "checkout", self._pool_checkout)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _pool_connect(self, dbapi_connection, connection_record):
+        self.inc("db_pool_connections_total")
+
+    def _pool_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.inc("db_pool_checkouts_total")
+
+    def pool_gauges(self):
+        # read when /metrics is scraped, only a QueuePool knows its size and overflow
+        pool = db.engine.pool
+        if not isinstance(pool, QueuePool):
+            return {}
+        return {
+            "db_pool_checked_out": pool.checkedout(),
+            "db_pool_overflow": pool.overflow(),
+            "db_pool_size": pool.size(),
+        }
+
+    # --- recording, no locks on this path
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = Shard(threading.current_thread())
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        counters = self._shard().counters
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        histograms = self._shard().histograms
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][2]
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(buckets) + 2)
+        # each observation is only counted in its own bucket, they are added up when rendered
+        index = 0
+        while index < len(buckets) and seconds > buckets[index]:
+            index += 1
+        values[index] += 1
+        values[-1] += seconds
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        blueprint = request.blueprint or "app"
+        endpoint = request.endpoint or "none"
+        self.observe(
+            "http_request_duration_seconds",
+            time.perf_counter() - start,
+            blueprint=blueprint,
+            endpoint=endpoint,
+        )
+        self.inc(
+            "http_requests_total",
+            blueprint=blueprint,
+            endpoint=endpoint,
+            method=request.method,
+            status=str(response.status_code),
+        )
+        self._maybe_flush()
+        return response
+
+    # --- reading
+
+    def collect(self):
+        # adds every thread's shard together, shards of finished threads are folded into the retired one
+        total = Shard()
+        with self._lock:
+            alive = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    alive.append(shard)
+                else:
+                    self._retired.merge(shard)
+            self._shards = alive
+            total.merge(self._retired)
+        for shard in alive:
+            # another thread may be adding a key while we copy
+            total.merge(_snapshot(shard))
+
+        return total, self.pool_gauges()
+
+    def _process_file(self, pid=None):
+        return os.path.join(self.directory, f"metrics-{pid or os.getpid()}.json")
+
+    def flush(self):
+        # writes this process' totals for the other processes to read, renamed into place so a reader never sees half a file
+        total, gauges = self.collect()
+        data = {
+            "counters": [
+                [name, labels, value]
+                for (name, labels), value in total.counters.items()
+            ],
+            "histograms": [
+                [name, labels, values]
+                for (name, labels), values in total.histograms.items()
+            ],
+            "gauges": gauges,
+        }
+        path = self._process_file()
+        # only one thread of this process writes the file at a time
+        with self._flush_lock:
+            with open(path + ".tmp", "w") as file:
+                json.dump(data, file)
+            os.replace(path + ".tmp", path)
+            self._flushed_at = time.monotonic()
+
+    def _maybe_flush(self):
+        if (
+            self.directory
+            and time.monotonic() - self._flushed_at > self.flush_seconds
+            and not self._flush_lock.locked()
+        ):
+            self.flush()
+
+    def _collect_processes(self):
+        self.flush()
+        total = Shard()
+        gauges = {}
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            pid = int(os.path.basename(path)[len("metrics-") : -len(".json")])
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            shard = Shard()
+            for name, labels, value in data["counters"]:
+                shard.counters[(name, tuple(map(tuple, labels)))] = value
+            for name, labels, values in data["histograms"]:
+                shard.histograms[(name, tuple(map(tuple, labels)))] = values
+            total.merge(shard)
+            if _process_alive(pid):
+                for name, value in data["gauges"].items():
+                    gauges[name] = gauges.get(name, 0) + value
+        return total, gauges
+
+    def render(self):
+        total, gauges = self._collect_processes() if self.directory else self.collect()
+
+        by_name = {}
+        for (name, labels), value in total.counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), values in total.histograms.items():
+            by_name.setdefault(name, []).append((labels, values))
+        for name, value in gauges.items():
+            by_name.setdefault(name, []).append(((), value))
+
+        lines = []
+        for name, (kind, description, buckets) in METRICS.items():
+            if name not in by_name:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name]):
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                running = 0
+                for bucket, count in zip(buckets, value):
+                    running += count
+                    lines.append(
+                        f"{name}_bucket{_labels(labels, le=_number(bucket))} {running}"
+                    )
+                running += value[len(buckets)]
+                lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {running}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {running}")
+        return "\n".join(lines) + "\n"
+
+
+def _snapshot(shard):
+    copy = Shard()
+    copy.counters = dict(shard.counters)
+    copy.histograms = {
+        key: list(values) for key, values in list(shard.histograms.items())
+    }
+    return copy
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+metrics = Metrics()
+
+
+class MeasuredQueuePool(QueuePool):
+    # the normal QueuePool, also recording the checkouts that had to wait for another request to give a connection back
+    def _do_get(self):
+        # the same test QueuePool uses to decide it has to block, nothing idle and no overflow left
+        waiting = (
+            self.checkedin() == 0
+            and self._max_overflow > -1
+            and self.overflow() >= self._max_overflow
+        )
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.inc("db_pool_timeouts_total")
+            raise
+        finally:
+            if waiting:
+                metrics.inc("db_pool_waits_total")
+                metrics.observe("db_pool_wait_seconds", time.perf_counter() - start)
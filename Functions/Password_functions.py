@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt as _bcrypt
+from Functions.Metrics_functions import metrics
+
+# Password hashing and checking, done in a small pool of separate processes instead of on the request thread. bcrypt is slow on purpose (about 250ms at the default cost) and holds the CPU the whole time, so during a burst of logins every request thread would be stuck hashing and every other endpoint would wait behind them.
+# The pool has PASSWORD_WORKERS processes and at most PASSWORD_QUEUE hashes waiting for one. When that is full the request gets a 503 with a Retry-After header straight away rather than joining a queue it would time out in.
+# BCRYPT_LOG_ROUNDS sets the cost of new hashes, a login with a password hashed at a different cost is hashed again at the new cost so raising (or lowering) it applies to everyone as they log in.
+# Logins for an email that doesn't exist are checked against a dummy hash of the same cost, so they take as long as a wrong password and the response time doesn't tell anyone which emails have accounts.
+# PASSWORD_WORKERS=0 hashes on the request thread like before, handy for the cli commands and debugging.
+
+
+class PasswordPoolFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(
+            "Too many passwords to check at once, please try again shortly"
+        )
+        self.retry_after = retry_after
+
+
+# these run in the worker processes so they only use the bcrypt library, no flask
+
+
+def _hash(password, rounds):
+    return _bcrypt.hashpw(password.encode("utf-8"), _bcrypt.gensalt(rounds)).decode(
+        "utf-8"
+    )
+
+
+def _check(pw_hash, password, rounds):
+    # returns (correct, new hash if the stored one used a different cost)
+    correct = _bcrypt.checkpw(password.encode("utf-8"), pw_hash.encode("utf-8"))
+    if correct and hash_rounds(pw_hash) != rounds:
+        return True, _hash(password, rounds)
+    return correct, None
+
+
+def hash_rounds(pw_hash):
+    # a bcrypt hash looks like $2b$12$<salt and hash>, the number is the cost
+    return int(pw_hash.split("$")[2])
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.rounds = 12
+        self.workers = 0
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._dummy_hash = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # flask-bcrypt reads BCRYPT_LOG_ROUNDS too so the seed commands use the same cost
+        self.rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+        self.workers = app.config.get("PASSWORD_WORKERS", os.cpu_count() or 1)
+        self.queue = app.config.get("PASSWORD_QUEUE", self.workers * 4)
+        self.retry_after = app.config.get("PASSWORD_RETRY_AFTER", 1)
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue)
+
+    def _pool(self):
+        # started on first use and again in every forked gunicorn worker, a pool inherited over fork has no processes behind it
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # forkserver (spawn where it doesn't exist) so the workers don't inherit the threads and connections of this process
+                    method = (
+                        "forkserver"
+                        if "forkserver" in multiprocessing.get_all_start_methods()
+                        else "spawn"
+                    )
+                    self._executor = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context(method)
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, operation, fn, *args):
+        with metrics.time("bcrypt_seconds", operation=operation):
+            if not self.workers:
+                return fn(*args)
+            # a slot for every hash running or waiting, none left means the pool is already as far behind as we allow
+            if not self._slots.acquire(blocking=False):
+                raise PasswordPoolFull(self.retry_after)
+            try:
+                future = self._pool().submit(fn, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda future: self._slots.release())
+            return future.result()
+
+    def hash(self, password):
+        return self._run("hash", _hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        # returns (correct, new hash to save or None)
+        return self._run("check", _check, pw_hash, password, self.rounds)
+
+    def check_missing_user(self, password):
+        # the same work as checking a real user's password, always wrong. The hash is of a random password made the first time it is needed
+        if self._dummy_hash is None or hash_rounds(self._dummy_hash) != self.rounds:
+            self._dummy_hash = self.hash(secrets.token_urlsafe(16))
+        self._run("check", _check, self._dummy_hash, password, self.rounds)
+        return False
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,209 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from init import db
+
+# Request profiler, turned on with PROFILE_REQUESTS=true. For every request it records how many SQL statements ran, how long they took, the slowest one and how long serializing the response took, then:
+#  - adds a Server-Timing header so the numbers show up in the browser dev tools (db, serialize and total)
+#  - keeps the last PROFILE_HISTORY requests for the /debug/profile summary
+#  - logs a warning when the same statement runs more than PROFILE_N_PLUS_ONE times in one request, the usual sign of a relationship being lazy loaded in a loop
+# When it is off none of the hooks are registered so it costs nothing.
+
+# placeholders in an IN (...) list and literal numbers are replaced so statements that only differ by their values count as the same shape
+_IN_LIST = re.compile(
+    r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+|\d+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+|\d+)\s*\)"
+)
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def statement_shape(statement):
+    return _NUMBER.sub("?", _IN_LIST.sub("(?)", " ".join(statement.split())))
+
+
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.slowest = (0.0, None)
+        self.shapes = Counter()
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.db_time += seconds
+        self.shapes[statement_shape(statement)] += 1
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+
+def current_profile():
+    if has_request_context():
+        return g.get("profile")
+    return None
+
+
+@contextmanager
+def timed_serialization():
+    # wrap anything that turns models into JSON, a no-op unless the request is being profiled
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serialize_time += time.perf_counter() - start
+
+
+class ProfilingJSONProvider(DefaultJSONProvider):
+    # the same provider flask uses, timing how long encoding the response takes
+    def dumps(self, obj, **kwargs):
+        with timed_serialization():
+            return super().dumps(obj, **kwargs)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.history = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("PROFILE_REQUESTS", False)
+        if not self.enabled:
+            return
+        self.threshold = app.config.get("PROFILE_N_PLUS_ONE", 5)
+        self.history = deque(maxlen=app.config.get("PROFILE_HISTORY", 200))
+        self.logger = app.logger
+
+        # swap in the timing json provider, keeping the settings of the old one
+        provider = ProfilingJSONProvider(app)
+        provider.sort_keys = app.json.sort_keys
+        provider.compact = app.json.compact
+        app.json = provider
+
+        with app.app_context():
+            self.watch_engine(db.engine)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def watch_engine(self, engine):
+        # the ASGI mode's async engine is watched as well
+        if not self.enabled:
+            return
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        context._profile_start = time.perf_counter()
+
+    def _after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        profile = current_profile()
+        if profile is not None:
+            profile.add_query(statement, time.perf_counter() - context._profile_start)
+
+    def _before_request(self):
+        g.profile = RequestProfile()
+
+    def _after_request(self, response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        total = time.perf_counter() - profile.start
+
+        response.headers["Server-Timing"] = (
+            f'db;dur={profile.db_time * 1000:.2f};desc="{profile.queries} queries", '
+            f"serialize;dur={profile.serialize_time * 1000:.2f}, "
+            f"total;dur={total * 1000:.2f}"
+        )
+
+        repeated = [
+            (shape, count)
+            for shape, count in profile.shapes.most_common()
+            if count > self.threshold
+        ]
+        for shape, count in repeated:
+            self.logger.warning(
+                "Possible N+1: %s %s ran the same statement %d times: %s",
+                request.method,
+                request.path,
+                count,
+                shape,
+            )
+
+        slowest_time, slowest_statement = profile.slowest
+        with self._lock:
+            self.history.append(
+                {
+                    "endpoint": request.endpoint,
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "total_ms": round(total * 1000, 3),
+                    "db_ms": round(profile.db_time * 1000, 3),
+                    "serialize_ms": round(profile.serialize_time * 1000, 3),
+                    "queries": profile.queries,
+                    "slowest_ms": round(slowest_time * 1000, 3),
+                    "slowest_statement": slowest_statement,
+                    "repeated_statements": [
+                        {"statement": shape, "count": count}
+                        for shape, count in repeated
+                    ],
+                }
+            )
+        return response
+
+    def summary(self):
+        # totals per endpoint plus the recent requests that had the slowest statements or looked like N+1s
+        with self._lock:
+            history = list(self.history)
+
+        endpoints = {}
+        for entry in history:
+            stats = endpoints.setdefault(
+                f"{entry['method']} {entry['endpoint']}",
+                {
+                    "requests": 0,
+                    "total_ms": 0.0,
+                    "db_ms": 0.0,
+                    "queries": 0,
+                    "max_ms": 0.0,
+                },
+            )
+            stats["requests"] += 1
+            stats["total_ms"] += entry["total_ms"]
+            stats["db_ms"] += entry["db_ms"]
+            stats["queries"] += entry["queries"]
+            stats["max_ms"] = max(stats["max_ms"], entry["total_ms"])
+
+        for stats in endpoints.values():
+            requests = stats.pop("requests")
+            stats.update(
+                requests=requests,
+                avg_ms=round(stats.pop("total_ms") / requests, 3),
+                avg_db_ms=round(stats.pop("db_ms") / requests, 3),
+                avg_queries=round(stats.pop("queries") / requests, 2),
+            )
+
+        return {
+            "requests": len(history),
+            "endpoints": endpoints,
+            "slowest": sorted(
+                history, key=lambda entry: entry["slowest_ms"], reverse=True
+            )[:10],
+            "n_plus_one": [entry for entry in history if entry["repeated_statements"]],
+        }
+
+
+profiler = Profiler()
@@ -0,0 +1,299 @@
+import base64
+import datetime
+import json
+from flask import Response, abort, current_app, request, stream_with_context
+from sqlalchemy import DateTime, and_, event, inspect, or_
+from sqlalchemy.orm import joinedload, selectinload
+from init import db
+from Models.recipe import Recipe, RecipeSchema
+from Models.review import Review
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+
+# The recipe schema nests a user, reviews (with their own user), ingredients and allergies. Left alone the schema walks each of these lazily which costs one SELECT per relation per recipe, so every recipe read path asks this module which loaders to attach to its query instead.
+
+# many-to-one relations are joined straight into the main query, collections are loaded with one extra "SELECT ... WHERE recipe_id IN (...)" each so the number of queries stays the same no matter how many recipes are returned
+RECIPE_LOADERS = {
+    "user": lambda: joinedload(Recipe.user),
+    "reviews": lambda: selectinload(Recipe.reviews).joinedload(Review.user),
+    "ingredients": lambda: selectinload(Recipe.ingredients).joinedload(
+        RecipeIngredient.ingredient
+    ),
+    "allergies": lambda: selectinload(Recipe.allergies).joinedload(
+        RecipeAllergy.allergy
+    ),
+}
+
+
+# a review only nests its author and the title of the recipe it belongs to, both many-to-one so they can be joined into the main query
+REVIEW_LOADERS = {
+    "user": lambda: joinedload(Review.user),
+    "recipe": lambda: joinedload(Review.recipe),
+}
+
+
+def recipe_loader_options(fields=None):
+    # fields is the list of top level recipe fields the endpoint is going to serialize, if nothing is passed we load every relation the RecipeSchema uses
+    if fields is None:
+        fields = RECIPE_LOADERS.keys()
+    return [RECIPE_LOADERS[field]() for field in fields if field in RECIPE_LOADERS]
+
+
+def select_recipes(fields=None):
+    # returns a select statement for recipes with the loaders already attached, the endpoints can then add their own filters to it
+    return db.select(Recipe).options(*recipe_loader_options(fields))
+
+
+# Sparse fieldsets. ?fields=id,title picks which recipe fields are sent and ?include=ingredients,allergies picks which relations are embedded, a relation that isn't asked for is never loaded from the database either. Without ?fields= every plain field is sent, so ?include= on its own (even empty) just trims the relations.
+def _field_list(value):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def recipe_fields():
+    # returns a tuple of the top level recipe fields to load and serialize, in the same order as a full recipe (RecipeSchema.Meta.fields), or None for the whole recipe when neither parameter is sent
+    fields = request.args.get("fields")
+    include = request.args.get("include")
+    if fields is None and include is None:
+        return None
+
+    if fields is not None:
+        selected = _field_list(fields)
+        unknown = selected - set(RecipeSchema.Meta.fields)
+        if unknown:
+            abort(400, description=f"Unknown fields: {', '.join(sorted(unknown))}")
+    else:
+        selected = {
+            field for field in RecipeSchema.Meta.fields if field not in RECIPE_LOADERS
+        }
+
+    included = _field_list(include or "")
+    unknown = included - set(RECIPE_LOADERS)
+    if unknown:
+        abort(
+            400,
+            description=f"'include' must be from {', '.join(RECIPE_LOADERS)}, "
+            f"not {', '.join(sorted(unknown))}",
+        )
+    selected |= included
+    if not selected:
+        abort(400, description="Please provide at least one field in 'fields'")
+    return tuple(field for field in RecipeSchema.Meta.fields if field in selected)
+
+
+def select_reviews():
+    return db.select(Review).options(*[loader() for loader in REVIEW_LOADERS.values()])
+
+
+# Keyset pagination. Instead of OFFSET (which makes the database walk past every skipped row) each page remembers the sort key of its last row and the next page asks for rows after it, so page 1000 costs the same as page 1.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    # the cursor is just the last row's key values, base64 encoded so clients treat it as an opaque string
+    values = [
+        value.isoformat() if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        # turn the datetime strings back into datetimes so they compare properly
+        return [
+            (
+                datetime.datetime.fromisoformat(value)
+                if isinstance(column.type, DateTime)
+                else value
+            )
+            for (column, descending), value in zip(keys, values)
+        ]
+    except (ValueError, TypeError):
+        abort(400, description="Invalid 'after' cursor")
+
+
+def page_limit():
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400, description="'limit' must be a number")
+    if limit < 1:
+        abort(400, description="'limit' must be at least 1")
+    # never hand back more than the hard maximum no matter what the client asks for
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# Batch reads. A client that needs many recipes at once sends their ids in one request instead of one request per recipe, the ids come from ?ids=1,2,3 or a json body of {"ids": [1, 2, 3]} for lists too long for a url
+MAX_BATCH_SIZE = 100
+
+
+def batch_ids():
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        ids = body.get("ids") if isinstance(body, dict) else None
+        if not isinstance(ids, list):
+            abort(400, description="Please provide 'ids' as a list of recipe ids")
+    else:
+        ids = [value for value in request.args.get("ids", "").split(",") if value]
+    try:
+        # bools are ints in python but true isn't a recipe id
+        if any(isinstance(value, bool) for value in ids):
+            raise ValueError
+        ids = [int(value) for value in ids]
+    except (ValueError, TypeError):
+        abort(400, description="'ids' must all be numbers")
+    # the same id asked for twice is only returned once, in the place it was first asked for
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        abort(400, description="Please provide at least one id in 'ids'")
+    if len(ids) > MAX_BATCH_SIZE:
+        abort(400, description=f"'ids' can have at most {MAX_BATCH_SIZE} ids")
+    return ids
+
+
+def keyset_page(stmt, keys):
+    # keys is a list of (column, descending) pairs, the last one should be unique (the id) so rows with the same sort value still have a stable order
+    limit = page_limit()
+    after = request.args.get("after")
+
+    if after:
+        values = decode_cursor(after, keys)
+        # rows after the cursor are the ones where every earlier key is equal and the next key is past the cursor value
+        conditions = []
+        for index, (column, descending) in enumerate(keys):
+            equal = [keys[i][0] == values[i] for i in range(index)]
+            past = column < values[index] if descending else column > values[index]
+            conditions.append(and_(*equal, past))
+        stmt = stmt.filter(or_(*conditions))
+
+    order = [
+        column.desc() if descending else column.asc() for column, descending in keys
+    ]
+    # fetch one extra row so we know if there is another page without running a count
+    rows = db.session.scalars(stmt.order_by(*order).limit(limit + 1)).unique().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            [getattr(rows[-1], column.key) for column, descending in keys]
+        )
+    return rows, next_cursor
+
+
+def page_response(data, next_cursor):
+    # every paginated endpoint returns the same shape
+    return {"data": data, "next_cursor": next_cursor}
+
+
+# Streaming exports. Dumping a whole table with schema.dump builds every row in memory first, instead this reads the rows a chunk at a time and writes each one out as its own line of JSON (NDJSON) while the response is being sent, so memory use stays flat however big the table gets.
+# The chunks are keyset pages on a unique column rather than a server side cursor, yield_per gets passed on to the selectin loaders and they can't use it together with their joined loads.
+EXPORT_CHUNK_SIZE = 500
+
+
+def export_response(stmt, schema, key):
+    # key is a unique column (the id) the rows are read in order of
+    # ndjson is the only format for now but I left the parameter in so other formats can be added later
+    export_format = request.args.get("format", "ndjson")
+    if export_format != "ndjson":
+        abort(400, description=f"Unsupported export format '{export_format}'")
+
+    def generate():
+        last = None
+        while True:
+            chunk_stmt = stmt.order_by(key).limit(EXPORT_CHUNK_SIZE)
+            if last is not None:
+                chunk_stmt = chunk_stmt.filter(key > last)
+            rows = db.session.scalars(chunk_stmt).unique().all()
+            if not rows:
+                return
+            last = getattr(rows[-1], key.key)
+            # one write per chunk rather than per row keeps the overhead down
+            yield "".join(
+                current_app.json.dumps(schema.dump(row), separators=(",", ":")) + "\n"
+                for row in rows
+            )
+            # let go of the rows that have been sent so the session doesn't grow with every chunk
+            db.session.expunge_all()
+            if len(rows) < EXPORT_CHUNK_SIZE:
+                return
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# small helper I use to check how many SQL statements a block of code sends to the database
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+# Index checks for "flask db check-indexes". Postgres doesn't index foreign key columns by itself, so every relationship load or cascade delete on an unindexed one reads the whole table.
+def unindexed_foreign_keys():
+    # returns (table, columns) for every foreign key in the database that isn't the start of an index, unique constraint or primary key
+    inspector = inspect(db.engine)
+    missing = []
+    for table in inspector.get_table_names():
+        covered = [inspector.get_pk_constraint(table).get("constrained_columns") or []]
+        covered += [index["column_names"] for index in inspector.get_indexes(table)]
+        covered += [
+            constraint["column_names"]
+            for constraint in inspector.get_unique_constraints(table)
+        ]
+        for foreign_key in inspector.get_foreign_keys(table):
+            columns = foreign_key["constrained_columns"]
+            if not any(list(index[: len(columns)]) == columns for index in covered):
+                missing.append((table, columns))
+    return missing
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def sequential_scans(stmt):
+    # returns the tables the database plans to read from start to finish for stmt, or None if the database can't be asked
+    sql = str(stmt.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    # straight to the driver so nothing in the SQL is mistaken for a bind parameter
+    connection = db.session.connection()
+    dialect = db.engine.dialect.name
+
+    if dialect == "postgresql":
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+        return [
+            node["Relation Name"]
+            for node in _plan_nodes(plan[0]["Plan"])
+            if node["Node Type"] == "Seq Scan"
+        ]
+    if dialect == "sqlite":
+        # sqlite says "SCAN table" for a full table read and "SEARCH table USING INDEX ..." or "SCAN table USING INDEX ..." when an index is used
+        details = [
+            row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+        ]
+        return [
+            detail.split()[1]
+            for detail in details
+            if detail.startswith("SCAN ") and " USING " not in detail
+        ]
+    return None
@@ -0,0 +1,54 @@
+from sqlalchemy import Float, case, cast, func
+from init import db
+from Models.recipe import Recipe
+from Models.review import Review
+
+# Rating totals. Each recipe keeps review_count, rating_sum and rating_avg up to date as reviews are created, changed and deleted, so showing a recipe's average or sorting by it never has to aggregate the reviews.
+# The changes are made with UPDATE ... SET review_count = review_count + 1 rather than read, add, write, so two reviews saved at the same moment can't overwrite each other's totals. Nothing here commits, it runs in the review handler's transaction.
+
+
+def _average(rating_sum, review_count):
+    # 0 rather than NULL for a recipe with no reviews, keeps the column NOT NULL and easy to sort
+    return case(
+        (review_count > 0, cast(rating_sum, Float) / review_count),
+        else_=0.0,
+    )
+
+
+def adjust_rating(recipe_id, count_change, rating_change):
+    # count_change is +1 for a new review, -1 for a deleted one and 0 when a review's rating is changed
+    review_count = Recipe.review_count + count_change
+    rating_sum = Recipe.rating_sum + rating_change
+    # every expression on the right of SET sees the old values of the row so the average is worked out from the new totals here
+    stmt = (
+        db.update(Recipe)
+        .filter(Recipe.id == recipe_id)
+        .values(
+            review_count=review_count,
+            rating_sum=rating_sum,
+            rating_avg=_average(rating_sum, review_count),
+        )
+    )
+    db.session.execute(stmt, execution_options={"synchronize_session": False})
+
+
+def refresh_ratings(recipe_ids=None):
+    # recalculates the totals from the reviews table for the recipes in recipe_ids or every recipe, for when reviews were deleted some other way than the review handlers (a user being deleted) or changed outside the api. The caller commits
+    review_count = (
+        db.select(func.count(Review.id))
+        .filter(Review.recipe_id == Recipe.id)
+        .scalar_subquery()
+    )
+    rating_sum = (
+        db.select(func.coalesce(func.sum(Review.rating), 0))
+        .filter(Review.recipe_id == Recipe.id)
+        .scalar_subquery()
+    )
+    stmt = db.update(Recipe).values(
+        review_count=review_count,
+        rating_sum=rating_sum,
+        rating_avg=_average(rating_sum, review_count),
+    )
+    if recipe_ids is not None:
+        stmt = stmt.filter(Recipe.id.in_(recipe_ids))
+    db.session.execute(stmt, execution_options={"synchronize_session": False})
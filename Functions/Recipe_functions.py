@@ -0,0 +1,167 @@
+from sqlalchemy import delete, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from init import db
+from Models.ingredient import Ingredient
+from Models.allergy import Allergy
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+
+# Writing a recipe's ingredients and allergies. Everything here runs inside the caller's transaction and never commits, so a recipe and all of its relations are saved with one commit (or rolled back together if any step fails).
+
+
+def upsert_insert(model):
+    # INSERT ... ON CONFLICT DO NOTHING is spelled differently by each database so pick the right insert for the one we are connected to
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=["name"])
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=["name"])
+    return insert(model)
+
+
+def resolve_names(model, names):
+    # returns {name: id} for every name, creating the ones that don't exist yet. That is one query for the names that exist and one insert for all the missing ones instead of a query and a commit per name.
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+
+    stmt = db.select(model.name, model.id).filter(model.name.in_(names))
+    found = dict(db.session.execute(stmt).all())
+
+    missing = [name for name in names if name not in found]
+    if missing:
+        stmt = (
+            upsert_insert(model)
+            .values([{"name": name} for name in missing])
+            .returning(model.name, model.id)
+        )
+        found.update(db.session.execute(stmt).all())
+
+        # ON CONFLICT DO NOTHING doesn't return rows that another request inserted at the same time, so fetch those
+        missing = [name for name in missing if name not in found]
+        if missing:
+            stmt = db.select(model.name, model.id).filter(model.name.in_(missing))
+            found.update(db.session.execute(stmt).all())
+    return found
+
+
+def ingredient_amounts(ingredients_data):
+    # the api takes ingredients as a list of { "ingredient": {"name": "..."}, "amount": "..." }, if a name is sent twice the last amount wins
+    return {
+        ingredient_data.get("ingredient", {}).get("name"): ingredient_data.get("amount")
+        for ingredient_data in ingredients_data or []
+    }
+
+
+def allergy_names(allergies_data):
+    # and allergies as a list of { "allergy": {"name": "..."} }
+    return list(
+        dict.fromkeys(
+            allergy_data.get("allergy", {}).get("name")
+            for allergy_data in allergies_data or []
+        )
+    )
+
+
+def add_recipe_ingredients(recipe_id, ingredients_data):
+    # bulk inserts the recipe_ingredient rows, returns the ingredient ids for the ingredient index
+    amounts = ingredient_amounts(ingredients_data)
+    ingredient_ids = resolve_names(Ingredient, list(amounts))
+    rows = [
+        {
+            "recipe_id": recipe_id,
+            "ingredient_id": ingredient_ids.get(name),
+            "amount": amount,
+        }
+        for name, amount in amounts.items()
+    ]
+    if rows:
+        db.session.execute(insert(RecipeIngredient), rows)
+    return [row["ingredient_id"] for row in rows]
+
+
+def add_recipe_allergies(recipe_id, allergies_data):
+    names = allergy_names(allergies_data)
+    allergy_ids = resolve_names(Allergy, names)
+    rows = [
+        {"recipe_id": recipe_id, "allergy_id": allergy_ids.get(name)} for name in names
+    ]
+    if rows:
+        db.session.execute(insert(RecipeAllergy), rows)
+    return [row["allergy_id"] for row in rows]
+
+
+# Updating a recipe. Rather than deleting every relation and inserting them all again, compare what the recipe has now with what the request wants and only insert, update or delete the rows that are different. Changing one amount is then a single UPDATE.
+
+
+def sync_recipe_ingredients(recipe_id, ingredients_data):
+    amounts = ingredient_amounts(ingredients_data)
+    ingredient_ids = resolve_names(Ingredient, list(amounts))
+    wanted = {ingredient_ids.get(name): amount for name, amount in amounts.items()}
+
+    stmt = db.select(
+        RecipeIngredient.id, RecipeIngredient.ingredient_id, RecipeIngredient.amount
+    ).filter_by(recipe_id=recipe_id)
+    current = {}
+    removed = []
+    for row_id, ingredient_id, amount in db.session.execute(stmt):
+        # anything the request doesn't have (or a duplicate row for the same ingredient) is deleted
+        if ingredient_id not in wanted or ingredient_id in current:
+            removed.append(row_id)
+        else:
+            current[ingredient_id] = (row_id, amount)
+
+    changed = [
+        {"id": row_id, "amount": wanted[ingredient_id]}
+        for ingredient_id, (row_id, amount) in current.items()
+        if wanted[ingredient_id] != amount
+    ]
+    added = [
+        {"recipe_id": recipe_id, "ingredient_id": ingredient_id, "amount": amount}
+        for ingredient_id, amount in wanted.items()
+        if ingredient_id not in current
+    ]
+
+    if removed:
+        db.session.execute(
+            delete(RecipeIngredient).filter(RecipeIngredient.id.in_(removed)),
+            execution_options={"synchronize_session": False},
+        )
+    if changed:
+        # a list of dictionaries with the primary key in each is a bulk UPDATE by id
+        db.session.execute(update(RecipeIngredient), changed)
+    if added:
+        db.session.execute(insert(RecipeIngredient), added)
+    return list(wanted)
+
+
+def sync_recipe_allergies(recipe_id, allergies_data):
+    names = allergy_names(allergies_data)
+    allergy_ids = resolve_names(Allergy, names)
+    wanted = {allergy_ids.get(name) for name in names}
+
+    stmt = db.select(RecipeAllergy.id, RecipeAllergy.allergy_id).filter_by(
+        recipe_id=recipe_id
+    )
+    current = set()
+    removed = []
+    for row_id, allergy_id in db.session.execute(stmt):
+        if allergy_id not in wanted or allergy_id in current:
+            removed.append(row_id)
+        else:
+            current.add(allergy_id)
+
+    added = [
+        {"recipe_id": recipe_id, "allergy_id": allergy_id}
+        for allergy_id in wanted
+        if allergy_id not in current
+    ]
+
+    if removed:
+        db.session.execute(
+            delete(RecipeAllergy).filter(RecipeAllergy.id.in_(removed)),
+            execution_options={"synchronize_session": False},
+        )
+    if added:
+        db.session.execute(insert(RecipeAllergy), added)
+    return list(wanted)
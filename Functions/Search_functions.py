@@ -0,0 +1,102 @@
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from init import db
+from Models.recipe import Recipe
+from Models.ingredient import Ingredient
+from Models.allergy import Allergy
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+from Functions.Query_functions import select_recipes
+from Functions.Index_functions import exclude_allergies_filter
+
+# All of the searching in the api goes through here. On postgres it uses the search_vector column for full text search over the title and instructions and the pg_trgm indexes for the name searches, on any other database it falls back to a plain ILIKE so the api still runs (slowly) for local testing.
+
+# the search_vector column isn't mapped on the Recipe model (see Models/recipe.py) so it is referenced directly
+search_vector = literal_column("recipes.search_vector", TSVECTOR)
+
+
+def is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+
+def name_filter(column, term):
+    # ILIKE '%term%' can use a trigram index, the % operator also matches names that are similar to the term so small typos still find results
+    condition = column.ilike(f"%{term}%")
+    if is_postgres():
+        condition = or_(condition, column.op("%")(term))
+    return condition
+
+
+def search_names(model, term):
+    # used by the ingredient and allergy ?search= endpoints, closest names come first
+    stmt = db.select(model).filter(name_filter(model.name, term))
+    if is_postgres():
+        stmt = stmt.order_by(func.similarity(model.name, term).desc(), model.id)
+    else:
+        stmt = stmt.order_by(model.id)
+    return db.session.scalars(stmt).all()
+
+
+def search_recipes(
+    text=None,
+    title=None,
+    ingredients=(),
+    allergies=(),
+    exclude_allergies=(),
+    limit=None,
+    fields=None,
+):
+    # every filter that is passed has to match, results are ranked by how well they match the text and title
+    # fields is passed on to select_recipes so only the relations the response needs are loaded
+    stmt = select_recipes(fields)
+    rank = []
+
+    if text:
+        if is_postgres():
+            query = func.websearch_to_tsquery("english", text)
+            stmt = stmt.filter(search_vector.op("@@")(query))
+            rank.append(func.ts_rank(search_vector, query))
+        else:
+            stmt = stmt.filter(
+                or_(
+                    Recipe.title.ilike(f"%{text}%"),
+                    Recipe.instructions.ilike(f"%{text}%"),
+                )
+            )
+
+    if title:
+        stmt = stmt.filter(name_filter(Recipe.title, title))
+        if is_postgres():
+            rank.append(func.similarity(Recipe.title, title))
+
+    # a recipe needs an ingredient matching each name that is passed
+    for ingredient in ingredients:
+        stmt = stmt.filter(
+            Recipe.id.in_(
+                db.select(RecipeIngredient.recipe_id)
+                .join(Ingredient)
+                .filter(name_filter(Ingredient.name, ingredient))
+            )
+        )
+
+    # and the same for allergies
+    for allergy in allergies:
+        stmt = stmt.filter(
+            Recipe.id.in_(
+                db.select(RecipeAllergy.recipe_id)
+                .join(Allergy)
+                .filter(name_filter(Allergy.name, allergy))
+            )
+        )
+
+    # leave out recipes containing any of these allergies using the allergy bitmask
+    allergy_filter = exclude_allergies_filter(exclude_allergies)
+    if allergy_filter is not None:
+        stmt = stmt.filter(allergy_filter)
+
+    if rank:
+        stmt = stmt.order_by(sum(rank[1:], rank[0]).desc())
+    stmt = stmt.order_by(Recipe.id)
+    if limit:
+        stmt = stmt.limit(limit)
+    return db.session.scalars(stmt).unique().all()
@@ -0,0 +1,139 @@
+import datetime
+from marshmallow import fields
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+from Functions.Profiler_functions import timed_serialization
+
+# Compiled serializers. marshmallow works out how to dump every field of every object again on each call (look up the attribute, dispatch to the field class, check for missing values...), on a page of recipes with their reviews, ingredients and allergies that is most of the CPU time of the request.
+# Schemas never change once the app is running, so this turns a schema into python source with one dictionary per object and the field conversions written out inline, then compiles it once. The output is the same dictionary marshmallow would build, so the JSON the client gets is byte for byte the same.
+# Only the field types the schemas in this api use get a fast path, anything else is handed back to the marshmallow field so it still comes out the same.
+
+# values an Inferred field (the fields only listed in Meta.fields) returns unchanged
+PASSTHROUGH_TYPES = {
+    type(None): None,
+    str: fields.String,
+    int: fields.Integer,
+    float: fields.Float,
+    bool: fields.Boolean,
+}
+
+
+class CompiledSchema:
+    def __init__(self, schema):
+        self.schema = schema
+        self._dump_one = None
+
+    def dump(self, obj, many=None):
+        # same call as schema.dump
+        many = self.schema.many if many is None else many
+        dump_one = self._dump_one or self.compile()
+        with timed_serialization():
+            if many:
+                return [dump_one(item) for item in obj]
+            # marshmallow dumps None as an empty dictionary at the top level
+            if obj is None:
+                return {}
+            return dump_one(obj)
+
+    def compile(self):
+        self._dump_one = compile_dump_function(self.schema)
+        return self._dump_one
+
+
+def compile_schema(schema):
+    # nested schemas are looked up by name so nothing is compiled until the first dump
+    return CompiledSchema(schema)
+
+
+def _inferred_is_passthrough(schema):
+    # only safe if the schema maps the basic types (and datetimes) to the default fields
+    return schema.TYPE_MAPPING.get(datetime.datetime) is fields.DateTime and all(
+        schema.TYPE_MAPPING.get(value_type) is field_class
+        for value_type, field_class in PASSTHROUGH_TYPES.items()
+        if field_class is not None
+    )
+
+
+def compile_dump_function(schema):
+    if schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP):
+        # the hooks can change anything so leave these schemas to marshmallow
+        return lambda obj: schema.dump(obj, many=False)
+
+    # everything the generated code refers to is passed in through this namespace
+    namespace = {"datetime": datetime.datetime, "PASSTHROUGH": set(PASSTHROUGH_TYPES)}
+    items = []
+
+    for index, (name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else name
+        attribute = field.attribute or name
+        field_name = f"field_{index}"
+        namespace[field_name] = field
+
+        if "." in attribute or not attribute.isidentifier():
+            # let marshmallow follow dotted attributes
+            namespace["schema"] = schema
+            items.append(
+                (
+                    key,
+                    f"{field_name}.serialize({name!r}, obj, accessor=schema.get_attribute)",
+                )
+            )
+            continue
+
+        value = f"(value := obj.{attribute})"
+        fallback = f"{field_name}._serialize(value, {attribute!r}, obj)"
+        field_type = type(field)
+
+        if field_type is fields.Inferred and _inferred_is_passthrough(schema):
+            expression = (
+                f"value if {value}.__class__ in PASSTHROUGH "
+                f"else value.isoformat() if value.__class__ is datetime "
+                f"else {fallback}"
+            )
+        elif field_type is fields.String:
+            expression = (
+                f"value if {value} is None or value.__class__ is str else {fallback}"
+            )
+        elif field_type is fields.Integer and not field.as_string:
+            expression = f"None if {value} is None else int(value)"
+        elif field_type is fields.Boolean:
+            expression = (
+                f"value if {value} is None or value.__class__ is bool else {fallback}"
+            )
+        elif field_type is fields.DateTime and field.format in (None, "iso"):
+            expression = f"None if {value} is None else value.isoformat()"
+        elif field_type is fields.Nested:
+            nested_name = f"nested_{index}"
+            namespace[nested_name] = compile_dump_function(field.schema)
+            if field.many:
+                # a many nested schema dumps a None item as an empty dictionary
+                expression = (
+                    f"None if {value} is None else "
+                    f"[{{}} if item is None else {nested_name}(item) for item in value]"
+                )
+            else:
+                expression = f"None if {value} is None else {nested_name}(value)"
+        elif field_type is fields.List and type(field.inner) is fields.Nested:
+            # lists of nested schemas, how the recipe holds its reviews, ingredients and allergies
+            nested_name = f"nested_{index}"
+            namespace[nested_name] = compile_dump_function(field.inner.schema)
+            expression = (
+                f"None if {value} is None else "
+                f"[None if item is None else {nested_name}(item) for item in value]"
+            )
+        elif field_type is fields.Raw:
+            expression = f"obj.{attribute}"
+        else:
+            # anything else goes through the field itself
+            expression = f"{field_name}._serialize({value}, {attribute!r}, obj)"
+
+        items.append((key, expression))
+
+    lines = ["def dump(obj):", "    return {"]
+    lines.extend(f"        {key!r}: {expression}," for key, expression in items)
+    lines.append("    }")
+
+    exec(
+        compile("\n".join(lines), f"<compiled {type(schema).__name__}>", "exec"),
+        namespace,
+    )
+    return namespace["dump"]
@@ -0,0 +1,301 @@
+import csv
+import datetime
+import io
+import random
+from bisect import bisect
+from itertools import accumulate
+from sqlalchemy import func, insert
+from init import db, bcrypt
+from Models.user import User
+from Models.recipe import Recipe
+from Models.review import Review
+from Models.ingredient import Ingredient
+from Models.allergy import Allergy
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+from Functions.Index_functions import allergy_mask
+from Functions.Recipe_functions import resolve_names
+
+# Generates a production sized database for load testing ("flask db seed-bulk"). Real recipe data is skewed, a handful of ingredients (salt, butter...) are in most recipes and most recipes only get a review or two while a few popular ones get hundreds, so the data here is generated the same way:
+#  - ingredient popularity follows a Zipf distribution, the nth most popular ingredient is used 1/n^ZIPF_EXPONENT as often as the most popular one
+#  - reviews per recipe follow a Pareto (power law) distribution with the requested average
+# The rows never go through the ORM. Ids are handed out here so every table can be written in big batches with COPY on postgres or executemany inserts on anything else, and each batch is committed before the next one is generated so memory use stays flat.
+
+ZIPF_EXPONENT = 1.1
+REVIEW_POWER_LAW = 1.5
+BATCH_SIZE = 10_000
+# ratings out of 10, people mostly review the recipes they liked
+RATINGS = range(1, 11)
+RATING_WEIGHTS = list(accumulate(RATINGS))
+# every user gets the same password, hashed once instead of once per user
+PASSWORD = "Coderacademy1!"
+
+ALLERGIES = [
+    "Pork",
+    "Dairy",
+    "Gluten",
+    "Eggs",
+    "Peanuts",
+    "Tree nuts",
+    "Soy",
+    "Fish",
+    "Shellfish",
+    "Sesame",
+    "Mustard",
+    "Celery",
+    "Lupin",
+    "Sulphites",
+]
+AMOUNTS = ["1", "2", "1 cup", "2 cups", "1 tbsp", "1 tsp", "100gm", "200gm", "to taste"]
+INSTRUCTIONS = "1. Prepare the ingredients. 2. Mix everything together. 3. Cook for 20 minutes. 4. Serve hot and enjoy!"
+
+
+class BulkWriter:
+    # writes lists of row tuples to a table in the fastest way the database supports
+    def __init__(self):
+        self.connection = db.session.connection()
+        self.postgres = db.engine.dialect.name == "postgresql"
+
+    def write(self, model, columns, rows):
+        if not rows:
+            return
+        table = model.__table__
+        if self.postgres:
+            # COPY streams the rows as CSV in one command, much faster than any INSERT
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor = self.connection.connection.cursor()
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        else:
+            self.connection.execute(
+                insert(table), [dict(zip(columns, row)) for row in rows]
+            )
+
+
+def next_id(model):
+    return (db.session.scalar(db.select(func.max(model.id))) or 0) + 1
+
+
+def reset_sequences():
+    # the ids were given explicitly so postgres' sequences still think the tables are empty
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in (User, Recipe, Review, Ingredient, RecipeIngredient, RecipeAllergy):
+        table = model.__table__.name
+        db.session.execute(
+            db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"coalesce(max(id), 1)) FROM {table}"
+            )
+        )
+
+
+def zipf_weights(count):
+    # cumulative weights so random.choices can pick with a binary search
+    return list(accumulate(1 / rank**ZIPF_EXPONENT for rank in range(1, count + 1)))
+
+
+def pick_distinct(rng, ids, cumulative, count):
+    # draws count different ids, popular ones much more often than the rest
+    count = min(count, len(ids))
+    picked = set()
+    total = cumulative[-1]
+    while len(picked) < count:
+        picked.add(ids[bisect(cumulative, rng.random() * total)])
+    return picked
+
+
+def review_count(rng, average):
+    # a pareto draw minus 1 has an average of 1 / (alpha - 1), scaled so the average comes out as requested
+    draw = rng.paretovariate(REVIEW_POWER_LAW) - 1
+    return int(draw * average * (REVIEW_POWER_LAW - 1))
+
+
+def seed_bulk(
+    users,
+    recipes,
+    reviews_per_recipe,
+    ingredients=2000,
+    ingredients_per_recipe=10,
+    seed=None,
+    progress=print,
+):
+    rng = random.Random(seed)
+    writer = BulkWriter()
+    now = datetime.datetime.now()
+    two_years = 2 * 365 * 24 * 60 * 60
+
+    def random_time():
+        return now - datetime.timedelta(seconds=rng.randrange(two_years))
+
+    # users, all with the one precomputed hash
+    password = bcrypt.generate_password_hash(PASSWORD).decode("utf-8")
+    first_user = next_id(User)
+    user_ids = range(first_user, first_user + users)
+    for start in range(0, users, BATCH_SIZE):
+        batch = user_ids[start : start + BATCH_SIZE]
+        writer.write(
+            User,
+            ["id", "name", "email", "password", "is_admin", "created"],
+            [
+                (
+                    user_id,
+                    f"user {user_id}",
+                    f"user{user_id}@bulk.email.com",
+                    password,
+                    False,
+                    random_time(),
+                )
+                for user_id in batch
+            ],
+        )
+        db.session.commit()
+        writer = BulkWriter()
+    progress(f"{users} users")
+
+    # ingredients, shuffled so the popular ones don't all have the lowest ids
+    first_ingredient = next_id(Ingredient)
+    ingredient_ids = list(range(first_ingredient, first_ingredient + ingredients))
+    for start in range(0, ingredients, BATCH_SIZE):
+        batch = ingredient_ids[start : start + BATCH_SIZE]
+        writer.write(
+            Ingredient,
+            ["id", "name"],
+            [(ingredient_id, f"ingredient {ingredient_id}") for ingredient_id in batch],
+        )
+        db.session.commit()
+        writer = BulkWriter()
+    rng.shuffle(ingredient_ids)
+    ingredient_weights = zipf_weights(len(ingredient_ids))
+
+    # the common allergies, reusing any that already exist
+    allergy_ids = list(resolve_names(Allergy, ALLERGIES).values())
+    allergy_weights = zipf_weights(len(allergy_ids))
+    db.session.commit()
+    progress(f"{ingredients} ingredients, {len(allergy_ids)} allergies")
+
+    # recipes and everything that belongs to them, a batch at a time
+    first_recipe = next_id(Recipe)
+    recipe_ingredient_id = next_id(RecipeIngredient)
+    recipe_allergy_id = next_id(RecipeAllergy)
+    review_id = next_id(Review)
+    totals = {"recipe_ingredient": 0, "recipe_allergy": 0, "reviews": 0}
+
+    for start in range(0, recipes, BATCH_SIZE):
+        writer = BulkWriter()
+        recipe_rows = []
+        ingredient_rows = []
+        allergy_rows = []
+        review_rows = []
+
+        for recipe_id in range(
+            first_recipe + start, first_recipe + min(start + BATCH_SIZE, recipes)
+        ):
+            owner = rng.choice(user_ids)
+            created = random_time()
+
+            for ingredient_id in pick_distinct(
+                rng,
+                ingredient_ids,
+                ingredient_weights,
+                rng.randint(
+                    ingredients_per_recipe // 2, ingredients_per_recipe * 3 // 2
+                ),
+            ):
+                ingredient_rows.append(
+                    (
+                        recipe_ingredient_id,
+                        recipe_id,
+                        ingredient_id,
+                        rng.choice(AMOUNTS),
+                    )
+                )
+                recipe_ingredient_id += 1
+
+            recipe_allergies = pick_distinct(
+                rng, allergy_ids, allergy_weights, rng.choice((0, 0, 1, 1, 2, 3))
+            )
+            for allergy_id in recipe_allergies:
+                allergy_rows.append((recipe_allergy_id, recipe_id, allergy_id))
+                recipe_allergy_id += 1
+
+            # nobody reviews their own recipe
+            rating_sum = 0
+            count = min(review_count(rng, reviews_per_recipe), users - 1)
+            for _ in range(count):
+                reviewer = rng.choice(user_ids)
+                while reviewer == owner:
+                    reviewer = rng.choice(user_ids)
+                rating = rng.choices(RATINGS, cum_weights=RATING_WEIGHTS)[0]
+                rating_sum += rating
+                review_rows.append(
+                    (
+                        review_id,
+                        "Generated review",
+                        rating,
+                        created + datetime.timedelta(seconds=rng.randrange(86400 * 30)),
+                        reviewer,
+                        recipe_id,
+                    )
+                )
+                review_id += 1
+
+            # the allergy mask and rating totals are known already, no rebuild needed afterwards
+            recipe_rows.append(
+                (
+                    recipe_id,
+                    f"Recipe {recipe_id}",
+                    rng.randint(1, 10),
+                    rng.randint(1, 12),
+                    INSTRUCTIONS,
+                    owner,
+                    created,
+                    allergy_mask(recipe_allergies),
+                    count,
+                    rating_sum,
+                    rating_sum / count if count else 0.0,
+                )
+            )
+
+        writer.write(
+            Recipe,
+            [
+                "id",
+                "title",
+                "difficulty",
+                "serving_size",
+                "instructions",
+                "user_id",
+                "created",
+                "allergy_mask",
+                "review_count",
+                "rating_sum",
+                "rating_avg",
+            ],
+            recipe_rows,
+        )
+        writer.write(
+            RecipeIngredient,
+            ["id", "recipe_id", "ingredient_id", "amount"],
+            ingredient_rows,
+        )
+        writer.write(RecipeAllergy, ["id", "recipe_id", "allergy_id"], allergy_rows)
+        writer.write(
+            Review,
+            ["id", "details", "rating", "created", "user_id", "recipe_id"],
+            review_rows,
+        )
+        db.session.commit()
+
+        totals["recipe_ingredient"] += len(ingredient_rows)
+        totals["recipe_allergy"] += len(allergy_rows)
+        totals["reviews"] += len(review_rows)
+        progress(f"{min(start + BATCH_SIZE, recipes)} of {recipes} recipes")
+
+    reset_sequences()
+    db.session.commit()
+    return totals
@@ -1,5 +1,6 @@
 from init import db, ma
 from marshmallow import fields
+from sqlalchemy import Index
 from Functions.Validation_functions import string_validation
 
 
@@ -7,6 +8,18 @@ class Ingredient(db.Model):
     __tablename__ = "ingredient"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
+    # bumped every time the row changes, used to build ETags (see Functions/Cache_functions.py)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # trigram index so name searches with ILIKE '%...%' can use an index (postgres only)
+    __table_args__ = (
+        Index(
+            "ix_ingredient_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
     recipes = db.relationship(
         "RecipeIngredient", back_populates="ingredient", cascade="all, delete"
     )
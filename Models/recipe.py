@@ -1,7 +1,9 @@
+import functools
 from init import db, ma
 from marshmallow import fields
 from Functions.Validation_functions import string_validation, integer_validation
-from sqlalchemy import DateTime
+from Functions.Serializer_functions import compile_schema
+from sqlalchemy import DateTime, DDL, Index, event
 import datetime
 
 
@@ -16,8 +18,31 @@ class Recipe(db.Model):
         db.Integer,
         db.ForeignKey("users.id"),
         nullable=False,
+        index=True,
     )
     created = db.Column(DateTime, default=datetime.datetime.now)
+    # one bit per allergy (bit 0 is allergy id 1) kept in sync with recipe_allergy so allergy filters don't need a join, see Functions/Index_functions.py
+    allergy_mask = db.Column(
+        db.BigInteger, nullable=False, default=0, server_default="0"
+    )
+    # running totals of the recipe's reviews so the average rating and count don't need every review loaded, kept up to date by the review handlers (see Functions/Rating_functions.py)
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_avg = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    # bumped every time the row changes, used to build ETags (see Functions/Cache_functions.py)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # trigram index so title searches with ILIKE '%...%' don't scan the whole table (postgres only)
+    __table_args__ = (
+        Index(
+            "ix_recipes_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        # for the top rated sort, walked backwards for rating_avg DESC, id DESC
+        Index("ix_recipes_rating_avg_id", "rating_avg", "id"),
+    )
 
     # Add foreign key relationships
     user = db.relationship("User", back_populates="recipes", cascade="all, delete")
@@ -34,6 +59,34 @@ class Recipe(db.Model):
     )
 
 
+# Full text search. The search_vector column only exists on postgres so it isn't mapped on the model, postgres generates it from the title and instructions itself so it never needs updating by hand. The same DDL lives in the migrations, these listeners just make "flask db create" build the same schema.
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(instructions, '')), 'B')"
+)
+
+event.listen(
+    db.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+event.listen(
+    Recipe.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE recipes ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED"
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Recipe.__table__,
+    "after_create",
+    DDL(
+        "CREATE INDEX ix_recipes_search_vector ON recipes USING gin (search_vector)"
+    ).execute_if(dialect="postgresql"),
+)
+
+
 # I created my own function to handle validation
 class RecipeSchema(ma.Schema):
     title = fields.Str(required=True, validate=string_validation(max=100))
@@ -68,8 +121,23 @@ class RecipeSchema(ma.Schema):
             "instructions",
             "ingredients",
             "allergies",
+            "review_count",
+            "rating_avg",
         )
 
 
 recipe_schema = RecipeSchema()
 recipes_schema = RecipeSchema(many=True)
+
+# compiled versions of the schemas above for the read endpoints, same output as .dump but much faster (see Functions/Serializer_functions.py)
+recipe_serializer = compile_schema(recipe_schema)
+recipes_serializer = compile_schema(recipes_schema)
+
+
+# compiled serializers for recipe reads that ask for only some of the fields (?fields= and ?include=, see recipe_fields in Functions/Query_functions.py), each set of fields is compiled the first time it is asked for and kept
+@functools.lru_cache(maxsize=256)
+def recipe_serializer_for(fields=None, many=False):
+    # fields is a tuple of top level field names in Meta.fields order, None is the full recipe
+    if fields is None:
+        return recipes_serializer if many else recipe_serializer
+    return compile_schema(RecipeSchema(only=fields, many=many))
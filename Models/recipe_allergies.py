@@ -6,7 +6,16 @@ class RecipeAllergy(db.Model):
     __tablename__ = "recipe_allergy"
     id = db.Column(db.Integer, primary_key=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey("recipes.id"), nullable=False)
-    allergy_id = db.Column(db.Integer, db.ForeignKey("allergy.id"), nullable=False)
+    allergy_id = db.Column(
+        db.Integer, db.ForeignKey("allergy.id"), nullable=False, index=True
+    )
+
+    # same as recipe_ingredient, one row per recipe and allergy
+    __table_args__ = (
+        db.UniqueConstraint(
+            "recipe_id", "allergy_id", name="uq_recipe_allergy_recipe_id_allergy_id"
+        ),
+    )
 
     recipe = db.relationship(
         "Recipe", back_populates="allergies", cascade="all, delete"
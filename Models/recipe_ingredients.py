@@ -8,10 +8,19 @@ class RecipeIngredient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey("recipes.id"), nullable=False)
     ingredient_id = db.Column(
-        db.Integer, db.ForeignKey("ingredient.id"), nullable=False
+        db.Integer, db.ForeignKey("ingredient.id"), nullable=False, index=True
     )
     amount = db.Column(db.String(50), nullable=False)
 
+    # a recipe can only list an ingredient once, the constraint's index also covers lookups by recipe_id
+    __table_args__ = (
+        db.UniqueConstraint(
+            "recipe_id",
+            "ingredient_id",
+            name="uq_recipe_ingredient_recipe_id_ingredient_id",
+        ),
+    )
+
     recipe = db.relationship(
         "Recipe", back_populates="ingredients", cascade="all, delete"
     )
@@ -1,8 +1,9 @@
 from init import db, ma
 from marshmallow import fields
-from sqlalchemy import DateTime
+from sqlalchemy import DateTime, Index
 import datetime
 from Functions.Validation_functions import string_validation, integer_validation
+from Functions.Serializer_functions import compile_schema
 
 
 class Review(db.Model):
@@ -11,12 +12,16 @@ class Review(db.Model):
     details = db.Column(db.String(500), nullable=False)
     rating = db.Column(db.Integer, nullable=False)
     created = db.Column(DateTime, default=datetime.datetime.now)
+    # bumped every time the row changes, used to build ETags (see Functions/Cache_functions.py)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     user_id = db.Column(
         db.Integer,
         db.ForeignKey("users.id"),
         nullable=False,
+        index=True,
     )
+    # no index of its own, ix_reviews_recipe_rating_created below starts with it
     recipe_id = db.Column(
         db.Integer,
         db.ForeignKey("recipes.id"),
@@ -27,6 +32,16 @@ class Review(db.Model):
     recipe = db.relationship("Recipe", back_populates="reviews")
 
 
+# a recipe's reviews in rating order are read straight off this index, including the newest first tie break and the id the pagination cursor ends with
+Index(
+    "ix_reviews_recipe_rating_created",
+    Review.recipe_id,
+    Review.rating.desc(),
+    Review.created.desc(),
+    Review.id.desc(),
+)
+
+
 # I created my own function to handle validation
 class ReviewSchema(ma.Schema):
     details = fields.Str(
@@ -43,3 +58,7 @@ class ReviewSchema(ma.Schema):
 
 review_schema = ReviewSchema(exclude=["recipe.id", "id"])
 reviews_schema = ReviewSchema(many=True, exclude=["recipe.id", "id"])
+
+# compiled versions for the read endpoints (see Functions/Serializer_functions.py)
+review_serializer = compile_schema(review_schema)
+reviews_serializer = compile_schema(reviews_schema)
@@ -13,6 +13,8 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     created = db.Column(DateTime, default=datetime.datetime.now)
+    # bumped every time the row changes, used to build ETags (see Functions/Cache_functions.py)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     reviews = db.relationship("Review", back_populates="user", cascade="all, delete")
     recipes = db.relationship("Recipe", back_populates="user", cascade="all, delete")
@@ -0,0 +1,9 @@
+# ASGI entry point, the read endpoints run on an event loop with an async database driver and everything else on the normal flask app (see Functions/Async_functions.py)
+#   python serve.py --async
+#   uvicorn --factory asgi:create_asgi_app
+from main import create_app
+from Functions.Async_functions import AsyncReadApp
+
+
+def create_asgi_app():
+    return AsyncReadApp(create_app())
@@ -0,0 +1,397 @@
+# Load test for the REST API. Starts the app from create_app() on a local threaded server, optionally builds and seeds the database, then sends the real endpoints requests from a pool of client threads and reports latency percentiles, throughput and SQL queries per request.
+#   smoke run on sqlite:   python benchmarks/api_benchmark.py --reset --recipes 2000
+#   against postgres:      DATABASE_URI=postgresql+psycopg2://... python benchmarks/api_benchmark.py --reset --recipes 100000
+#   compare with a stored run:  python benchmarks/api_benchmark.py --output new.json --baseline baseline.json
+#   under gunicorn (serve.py):  python benchmarks/api_benchmark.py --workers 4 --threads 8
+#   the ASGI mode on the same database:  python benchmarks/api_benchmark.py --workers 4 --async --concurrency 128
+# The response cache is turned off unless CACHE_BACKEND is set, otherwise the read endpoints would only be measuring the cache, and so is the login rate limit unless RATELIMIT_BACKEND is set.
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URI", "sqlite:////tmp/recipe_api_benchmark.db")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+os.environ.setdefault("CACHE_BACKEND", "none")
+os.environ.setdefault("RATELIMIT_BACKEND", "none")
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+from main import create_app
+from init import db
+from Models.recipe import Recipe
+
+# the admin user "flask db seed" creates
+EMAIL = "Simon@email.com"
+PASSWORD = "Coderacademy1!"
+SEARCH_TERMS = ["cheese", "chicken", "recipe", "pork", "sauce", "cook"]
+
+
+class QueryTally:
+    # counts every statement the server sends while a scenario runs, divided by the requests afterwards
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def take(self):
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+class Client:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.token = None
+
+    def request(self, method, path, body=None):
+        # returns (status, seconds), any HTTP status is a result, only connection problems raise
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as err:
+            err.read()
+            status = err.code
+        return status, time.perf_counter() - start
+
+    def login(self):
+        request = urllib.request.Request(
+            self.base_url + "/auth/login",
+            data=json.dumps({"email": EMAIL, "password": PASSWORD}).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            self.token = json.loads(response.read())["token"]
+
+
+def letters(number):
+    # recipe titles can only contain letters so numbers are written as a, b, ... z, ba, bb ...
+    text = ""
+    while True:
+        number, digit = divmod(number, 26)
+        text = chr(ord("a") + digit) + text
+        if not number:
+            return text
+
+
+def scenarios(recipe_ids, run_id):
+    # name -> (expected status, function returning (method, path, body)), each call is one request
+    counter = iter(range(10**9))
+    return {
+        "login": (
+            200,
+            lambda: ("POST", "/auth/login", {"email": EMAIL, "password": PASSWORD}),
+        ),
+        "list recipes": (200, lambda: ("GET", "/recipes/?limit=50", None)),
+        "get recipe": (
+            200,
+            lambda: ("GET", f"/recipes/{random.choice(recipe_ids)}", None),
+        ),
+        "search": (
+            None,
+            lambda: ("GET", f"/recipes/search?q={random.choice(SEARCH_TERMS)}", None),
+        ),
+        "recipe reviews": (
+            200,
+            lambda: ("GET", f"/review/{random.choice(recipe_ids)}?highest=1", None),
+        ),
+        "create recipe": (
+            201,
+            lambda: (
+                "POST",
+                "/recipes/create",
+                {
+                    "title": f"Benchmark {letters(run_id)} {letters(next(counter))}",
+                    "difficulty": 3,
+                    "serving_size": 2,
+                    "instructions": "Mix everything together and bake for 20 minutes",
+                    "ingredients": [
+                        {"ingredient": {"name": "butter"}, "amount": "100gm"},
+                        {"ingredient": {"name": "flour"}, "amount": "2 cups"},
+                    ],
+                    "allergies": [{"allergy": {"name": "Dairy"}}],
+                },
+            ),
+        ),
+    }
+
+
+def percentile(sorted_values, percent):
+    # nearest rank
+    if not sorted_values:
+        return None
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_scenario(client, expected, make_request, requests, concurrency):
+    def one(_):
+        method, path, body = make_request()
+        status, seconds = client.request(method, path, body)
+        # search can legitimately 404 when nothing matches
+        ok = status == expected if expected else status < 500
+        return ok, seconds
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds for ok, seconds in results)
+    return {
+        "requests": requests,
+        "errors": sum(1 for ok, seconds in results if not ok),
+        "throughput": round(requests / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def prepare_database(app, args):
+    runner = app.test_cli_runner()
+    commands = [["db", "drop"], ["db", "create"], ["db", "seed"]]
+    if args.recipes:
+        commands.append(
+            [
+                "db",
+                "seed-bulk",
+                "--users",
+                str(args.users),
+                "--recipes",
+                str(args.recipes),
+                "--reviews-per-recipe",
+                str(args.reviews_per_recipe),
+                "--seed",
+                str(args.seed),
+            ]
+        )
+    for command in commands:
+        result = runner.invoke(args=command)
+        if result.exit_code != 0:
+            sys.exit(f"flask {' '.join(command)} failed: {result.output}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, threads, async_mode=False):
+    # runs serve.py the way production does, the queries happen in the worker processes so they can't be counted from here
+    port = free_port()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), WEB_THREADS=str(threads))
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(root, "serve.py"),
+            "--bind",
+            f"127.0.0.1:{port}",
+            *(["--async"] if async_mode else []),
+        ],
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base_url + "/").read()
+            return process, base_url
+        except OSError:
+            if process.poll() is not None:
+                sys.exit("serve.py exited before it started listening")
+            time.sleep(0.1)
+    process.terminate()
+    sys.exit("serve.py didn't start listening")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline, max_regression):
+    # prints the change against the baseline for every scenario both runs have, returns the scenarios that got slower than allowed
+    regressions = []
+    print(f"\n{'compared to baseline':<16} {'p95':>10} {'throughput':>12}")
+    for name, stats in results["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old:
+            continue
+        p95_change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+        throughput_change = (
+            (stats["throughput"] - old["throughput"]) / old["throughput"] * 100
+        )
+        print(f"{name:<16} {p95_change:>+9.1f}% {throughput_change:>+11.1f}%")
+        if p95_change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--reset", action="store_true", help="drop, create and seed the database first"
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--recipes",
+        type=int,
+        default=0,
+        help="recipes for seed-bulk to add with --reset",
+    )
+    parser.add_argument("--reviews-per-recipe", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--requests", type=int, default=500, help="requests per scenario"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="run the app under gunicorn with this many worker processes instead of in this process",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=4, help="threads per gunicorn worker"
+    )
+    parser.add_argument(
+        "--async",
+        dest="async_mode",
+        action="store_true",
+        help="with --workers, run serve.py --async (the ASGI app)",
+    )
+    parser.add_argument("--scenario", action="append", help="only run these scenarios")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="JSON results of an earlier run to compare with"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=10,
+        help="percent the p95 can get worse by before the run fails",
+    )
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.reset:
+            prepare_database(app, args)
+        recipe_ids = db.session.scalars(
+            db.select(Recipe.id).order_by(db.func.random()).limit(5000)
+        ).all()
+        dialect = db.engine.dialect.name
+        tally = QueryTally(db.engine)
+    if not recipe_ids:
+        sys.exit("The database has no recipes, run with --reset")
+
+    if args.workers:
+        process, base_url = start_gunicorn(args.workers, args.threads, args.async_mode)
+        tally = None
+    else:
+        # werkzeug logs every request, far too much output here
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+    client = Client(base_url)
+    client.login()
+    random.seed(args.seed)
+
+    results = {
+        "date": datetime.datetime.now().isoformat(),
+        "commit": git_commit(),
+        "database": dialect,
+        "recipes": len(recipe_ids),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "server": (
+            (
+                f"gunicorn {args.workers} uvicorn workers"
+                if args.async_mode
+                else f"gunicorn {args.workers} workers x {args.threads} threads"
+            )
+            if args.workers
+            else "werkzeug threaded"
+        ),
+        "scenarios": {},
+    }
+    print(
+        f"{'scenario':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'req/s':>8} {'queries':>8} {'errors':>7}"
+    )
+    run_id = int(time.time())
+    for name, (expected, make_request) in scenarios(recipe_ids, run_id).items():
+        if args.scenario and name not in args.scenario:
+            continue
+        if tally:
+            tally.take()
+        stats = run_scenario(
+            client, expected, make_request, args.requests, args.concurrency
+        )
+        stats["queries_per_request"] = (
+            round(tally.take() / args.requests, 2) if tally else None
+        )
+        results["scenarios"][name] = stats
+        queries = f"{stats['queries_per_request']:>8.2f}" if tally else f"{'-':>8}"
+        print(
+            f"{name:<16} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+            f"{stats['p99_ms']:>8.2f} {stats['throughput']:>8.1f} "
+            f"{queries} {stats['errors']:>7}"
+        )
+    if args.workers:
+        process.terminate()
+        process.wait()
+    else:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            sys.exit(
+                f"p95 regressed more than {args.max_regression}%: {', '.join(regressions)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
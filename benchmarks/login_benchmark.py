@@ -0,0 +1,143 @@
+# Login throughput under concurrency. Sends bursts of logins at each concurrency level while another thread keeps requesting a cheap endpoint, so it shows both how many logins a second the password pool gets through and whether the rest of the API stays responsive while it does.
+#   python benchmarks/login_benchmark.py --reset --concurrency 1 4 16 64
+#   compare with hashing on the request threads:  PASSWORD_WORKERS=0 python benchmarks/login_benchmark.py
+#   under gunicorn:  python benchmarks/login_benchmark.py --workers 4
+# 503s are expected once the concurrency is bigger than PASSWORD_WORKERS + PASSWORD_QUEUE, that is the pool pushing back.
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URI", "sqlite:////tmp/recipe_api_benchmark.db")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+os.environ.setdefault("CACHE_BACKEND", "none")
+os.environ.setdefault("RATELIMIT_BACKEND", "none")
+
+from werkzeug.serving import make_server
+from main import create_app
+from api_benchmark import (
+    EMAIL,
+    PASSWORD,
+    Client,
+    percentile,
+    prepare_database,
+    start_gunicorn,
+)
+
+PROBE_PATH = "/recipes/?limit=10"
+
+
+class Probe:
+    # requests PROBE_PATH one after another until stopped, the latency other users see during the logins
+    def __init__(self, client):
+        self.client = client
+        self.latencies = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            status, seconds = self.client.request("GET", PROBE_PATH)
+            self.latencies.append(seconds)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_logins(base_url, requests, concurrency):
+    client = Client(base_url)
+    body = {"email": EMAIL, "password": PASSWORD}
+
+    def one(_):
+        return client.request("POST", "/auth/login", body)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = sorted(seconds for status, seconds in results if status == 200)
+    return {
+        "ok": len(ok),
+        "rejected": sum(1 for status, seconds in results if status == 503),
+        "errors": sum(1 for status, seconds in results if status not in (200, 503)),
+        "logins_per_second": len(ok) / elapsed,
+        "p50_ms": percentile(ok, 50) * 1000 if ok else 0,
+        "p95_ms": percentile(ok, 95) * 1000 if ok else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--reset", action="store_true", help="drop, create and seed the database first"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument(
+        "--requests", type=int, default=64, help="logins per concurrency level"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="run the app under gunicorn with this many worker processes instead of in this process",
+    )
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    app = create_app()
+    if args.reset:
+        # prepare_database only adds seed-bulk data when asked for recipes
+        args.recipes = 0
+        with app.app_context():
+            prepare_database(app, args)
+
+    if args.workers:
+        process, base_url = start_gunicorn(args.workers, args.threads)
+    else:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    probe_client = Client(base_url)
+    probe_client.login()
+    # the first login starts the password processes, keep that out of the numbers
+    with Probe(probe_client) as idle:
+        time.sleep(1)
+    print(
+        f"{PROBE_PATH} with no logins: p95 "
+        f"{percentile(sorted(idle.latencies), 95) * 1000:.1f} ms"
+    )
+
+    print(
+        f"{'concurrency':>11} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'503s':>6} {'errors':>6} {'other p95 ms':>13}"
+    )
+    for concurrency in args.concurrency:
+        with Probe(probe_client) as probe:
+            stats = run_logins(base_url, args.requests, concurrency)
+        probe_p95 = percentile(sorted(probe.latencies), 95) * 1000
+        print(
+            f"{concurrency:>11} {stats['logins_per_second']:>9.1f} "
+            f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+            f"{stats['rejected']:>6} {stats['errors']:>6} {probe_p95:>13.1f}"
+        )
+
+    if args.workers:
+        process.terminate()
+        process.wait()
+    else:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Compares the compiled recipe serializer with recipes_schema.dump and checks the JSON they produce is byte for byte the same.
+# By default it builds fake recipes in memory so no database is needed:
+#   python benchmarks/serializer_benchmark.py --recipes 200 --reviews 10 --ingredients 12
+# or pass --from-db to dump the recipes that are in DATABASE_URI instead.
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+from main import create_app
+from init import db
+from Models.user import User
+from Models.recipe import Recipe, recipes_schema, recipes_serializer
+from Models.review import Review
+from Models.ingredient import Ingredient
+from Models.allergy import Allergy
+from Models.recipe_ingredients import RecipeIngredient
+from Models.recipe_allergies import RecipeAllergy
+from Functions.Query_functions import select_recipes
+
+
+def fake_recipes(count, reviews, ingredients, allergies):
+    # transient objects, never added to a session
+    created = datetime.datetime(2024, 1, 1, 12, 30)
+    users = [
+        User(id=i, name=f"user {i}", email=f"user{i}@email.com", created=created)
+        for i in range(1, 51)
+    ]
+    ingredient_rows = [Ingredient(id=i, name=f"ingredient {i}") for i in range(1, 201)]
+    allergy_rows = [Allergy(id=i, name=f"allergy {i}") for i in range(1, 21)]
+
+    recipes = []
+    for i in range(1, count + 1):
+        recipe = Recipe(
+            id=i,
+            title=f"Recipe number {i} with ünïcode",
+            difficulty=i % 10,
+            serving_size=i % 8 + 1,
+            instructions="Mix everything together, bake for 20 minutes. " * 3,
+            user=users[i % len(users)],
+            created=created,
+        )
+        recipe.reviews = [
+            Review(
+                id=i * 1000 + j,
+                details=f"Review {j} of recipe {i}",
+                rating=(i + j) % 100,
+                created=created + datetime.timedelta(minutes=j),
+                user=users[(i + j) % len(users)],
+            )
+            for j in range(reviews)
+        ]
+        recipe.ingredients = [
+            RecipeIngredient(
+                id=i * 1000 + j,
+                amount=f"{j + 1} cups",
+                ingredient=ingredient_rows[(i * 7 + j) % len(ingredient_rows)],
+            )
+            for j in range(ingredients)
+        ]
+        recipe.allergies = [
+            RecipeAllergy(
+                id=i * 1000 + j, allergy=allergy_rows[(i + j) % len(allergy_rows)]
+            )
+            for j in range(allergies)
+        ]
+        recipes.append(recipe)
+    return recipes
+
+
+def best_of(repeat, fn):
+    # fastest run is the one with the least noise from the rest of the machine
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipes", type=int, default=200)
+    parser.add_argument("--reviews", type=int, default=10)
+    parser.add_argument("--ingredients", type=int, default=12)
+    parser.add_argument("--allergies", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--from-db", action="store_true")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.from_db:
+            recipes = db.session.scalars(select_recipes()).unique().all()
+        else:
+            recipes = fake_recipes(
+                args.recipes, args.reviews, args.ingredients, args.allergies
+            )
+
+        # the response body flask would send for each
+        expected = app.json.dumps(recipes_schema.dump(recipes))
+        actual = app.json.dumps(recipes_serializer.dump(recipes))
+        if expected != actual:
+            sys.exit("The compiled serializer output is different to marshmallow's")
+
+        marshmallow_time = best_of(args.repeat, lambda: recipes_schema.dump(recipes))
+        compiled_time = best_of(args.repeat, lambda: recipes_serializer.dump(recipes))
+
+    print(f"{len(recipes)} recipes, {len(expected)} bytes of JSON, output identical")
+    print(f"recipes_schema.dump      {marshmallow_time * 1000:8.2f} ms")
+    print(f"recipes_serializer.dump  {compiled_time * 1000:8.2f} ms")
+    print(f"speed up                 {marshmallow_time / compiled_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import glob
+import os
+import tempfile
+from Functions.Config_functions import env_int, thread_count, worker_count
+
+# gunicorn settings for "python serve.py" (or "gunicorn main:create_app()" run from this folder, gunicorn reads this file by default).
+# WEB_CONCURRENCY worker processes each running WEB_THREADS threads, Functions/Config_functions.py sizes each worker's connection pool from the same two variables.
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', 8080)}")
+workers = worker_count()
+threads = thread_count()
+worker_class = "gthread"
+# the app reads this too, anything it keeps in process memory (the response cache) is only seen by one worker when there are several
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+# load the app once in the master and fork it into the workers, quicker to start and the workers share the memory
+preload_app = True
+timeout = env_int("WEB_TIMEOUT", 30)
+graceful_timeout = 30
+keepalive = 5
+# restart workers now and then so a slow leak can't grow forever, the jitter stops them all restarting at once
+max_requests = env_int("WEB_MAX_REQUESTS", 10000)
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get("ACCESS_LOG")
+
+# every worker writes its numbers here so /metrics adds up all of them instead of whichever worker answered
+os.environ.setdefault(
+    "METRICS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "recipe_api_metrics")
+)
+
+
+def on_starting(server):
+    # numbers left behind by the last run
+    for path in glob.glob(
+        os.path.join(os.environ["METRICS_MULTIPROC_DIR"], "metrics-*.json")
+    ):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    # a forked worker must never use the connections the master opened while loading the app, two processes talking on one socket corrupts both.
+    # close=False only forgets them in the worker, closing them here would close them for the master too
+    from init import db
+
+    app = server.app.wsgi()
+    # in async mode this is the ASGI wrapper around the flask app
+    app = getattr(app, "app", app)
+    with app.app_context():
+        db.engine.dispose(close=False)
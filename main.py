@@ -1,7 +1,11 @@
 import os
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from init import db, ma, bcrypt, jwt, migrate
 from marshmallow.exceptions import ValidationError
+from Functions.Config_functions import configure_production
+from Functions.Password_functions import PasswordPoolFull, passwords
+from Functions.Limiter_functions import RateLimited, login_limiter
 
 
 def create_app():
@@ -11,6 +15,89 @@ def create_app():
     # configs
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URI")
     app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
+    # how long (seconds) the authorization decorators can reuse a user lookup, 0 turns the cache off
+    app.config["AUTH_CACHE_TTL"] = int(os.environ.get("AUTH_CACHE_TTL", 30))
+    # trust the is_admin claim in the token instead of checking the database
+    app.config["JWT_TRUST_ADMIN_CLAIM"] = (
+        os.environ.get("JWT_TRUST_ADMIN_CLAIM", "false").lower() == "true"
+    )
+    # "development" or "production", serve.py sets production
+    app.config["APP_ENV"] = os.environ.get("APP_ENV", "development")
+    # how many gunicorn worker processes share the requests (gunicorn.conf.py sets it), 1 when run any other way
+    app.config["WORKER_PROCESSES"] = int(os.environ.get("WEB_CONCURRENCY", 1))
+    # response cache for the recipe reads, "memory", "redis" or "none". The memory cache can't see writes made by other processes, so with several workers or in production it is off unless redis is set
+    app.config["CACHE_BACKEND"] = os.environ.get(
+        "CACHE_BACKEND",
+        (
+            "memory"
+            if app.config["WORKER_PROCESSES"] == 1
+            and app.config["APP_ENV"] != "production"
+            else "none"
+        ),
+    )
+    app.config["CACHE_REDIS_URL"] = os.environ.get(
+        "CACHE_REDIS_URL", "redis://localhost:6379/0"
+    )
+    app.config["CACHE_TTL"] = int(os.environ.get("CACHE_TTL", 60))
+    # per request query counts and timings in a Server-Timing header and at /debug/profile, off by default
+    app.config["PROFILE_REQUESTS"] = (
+        os.environ.get("PROFILE_REQUESTS", "false").lower() == "true"
+    )
+    # log a warning when one request runs the same statement more than this many times
+    app.config["PROFILE_N_PLUS_ONE"] = int(os.environ.get("PROFILE_N_PLUS_ONE", 5))
+    # how many recent requests /debug/profile summarises
+    app.config["PROFILE_HISTORY"] = int(os.environ.get("PROFILE_HISTORY", 200))
+    # prometheus metrics at /metrics, off by default
+    app.config["METRICS_ENABLED"] = (
+        os.environ.get("METRICS_ENABLED", "false").lower() == "true"
+    )
+    # /metrics shows internal timings so it needs "Authorization: Bearer <METRICS_TOKEN>", required when metrics are on (prometheus sends it with the authorization setting of the scrape job)
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+    # with more than one worker process set this to a directory they can all write to so /metrics covers every worker
+    app.config["METRICS_MULTIPROC_DIR"] = os.environ.get("METRICS_MULTIPROC_DIR")
+    # how often (seconds) each worker writes its numbers to that directory
+    app.config["METRICS_FLUSH_SECONDS"] = int(
+        os.environ.get("METRICS_FLUSH_SECONDS", 5)
+    )
+    # bcrypt cost of new password hashes, existing ones are rehashed when the user logs in
+    app.config["BCRYPT_LOG_ROUNDS"] = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    # processes that hash passwords (0 hashes on the request thread) and how many hashes can wait for them before logins get a 503
+    app.config["PASSWORD_WORKERS"] = int(
+        os.environ.get("PASSWORD_WORKERS", os.cpu_count() or 1)
+    )
+    app.config["PASSWORD_QUEUE"] = int(
+        os.environ.get("PASSWORD_QUEUE", app.config["PASSWORD_WORKERS"] * 4)
+    )
+    app.config["PASSWORD_RETRY_AFTER"] = int(os.environ.get("PASSWORD_RETRY_AFTER", 1))
+    # login rate limits, attempts per minute and how many can come at once, per IP address and per email. RATELIMIT_BACKEND is "memory", "redis" or "none", memory buckets are per process so with several workers or in production it is redis
+    app.config["RATELIMIT_BACKEND"] = os.environ.get(
+        "RATELIMIT_BACKEND",
+        (
+            "memory"
+            if app.config["WORKER_PROCESSES"] == 1
+            and app.config["APP_ENV"] != "production"
+            else "redis"
+        ),
+    )
+    app.config["RATELIMIT_REDIS_URL"] = os.environ.get(
+        "RATELIMIT_REDIS_URL", app.config["CACHE_REDIS_URL"]
+    )
+    app.config["LOGIN_IP_PER_MINUTE"] = int(os.environ.get("LOGIN_IP_PER_MINUTE", 30))
+    app.config["LOGIN_IP_BURST"] = int(os.environ.get("LOGIN_IP_BURST", 10))
+    app.config["LOGIN_EMAIL_PER_MINUTE"] = int(
+        os.environ.get("LOGIN_EMAIL_PER_MINUTE", 5)
+    )
+    app.config["LOGIN_EMAIL_BURST"] = int(os.environ.get("LOGIN_EMAIL_BURST", 5))
+    # how many proxies (nginx, a load balancer) are in front of the app, their X-Forwarded-For header gives the real client IP for the rate limits
+    app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+    # "production" sizes the connection pool for the gunicorn workers and sets the connection timeouts
+    if app.config["APP_ENV"] == "production":
+        configure_production(app)
+    # in ASGI mode (serve.py --async) the threads the rest of the api (writes, logins, exports) runs on
+    app.config["ASYNC_WSGI_THREADS"] = int(os.environ.get("ASYNC_WSGI_THREADS", 10))
+    # a python file of config values, loaded last so anything in it wins
+    if os.environ.get("APP_CONFIG_FILE"):
+        app.config.from_pyfile(os.environ["APP_CONFIG_FILE"])
 
     @app.errorhandler(ValidationError)
     def validation_error(error):
@@ -32,16 +119,44 @@ def create_app():
     def method_not_allowed(err):
         return {"error": str(err)}, 405
 
+    @app.errorhandler(PasswordPoolFull)
+    def password_pool_full(err):
+        return {"error": str(err)}, 503, {"Retry-After": str(err.retry_after)}
+
+    @app.errorhandler(RateLimited)
+    def rate_limited(err):
+        return {"error": str(err)}, 429, {"Retry-After": str(err.retry_after)}
+
     @app.errorhandler(500)
     def server_error(err):
         return {"error": str(err)}, 500
 
+    from Functions.Metrics_functions import metrics
+
+    # before db.init_app, it picks the connection pool class
+    metrics.init_app(app)
+
     # connect libraries with flask app
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
+    passwords.init_app(app)
+    login_limiter.init_app(app)
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
     jwt.init_app(app)
-    migrate.init_app(app, db)
+    # point flask-migrate at the migrations folder next to this file so the commands work from any directory
+    migrate.init_app(
+        app, db, directory=os.path.join(os.path.dirname(__file__), "migrations")
+    )
+
+    from Functions.Cache_functions import response_cache
+
+    response_cache.init_app(app)
+
+    from Functions.Profiler_functions import profiler
+
+    profiler.init_app(app)
 
     from Controllers.cli_controller import db_commands
     from Controllers.recipe_controller import db_recipes
@@ -57,6 +172,21 @@ def create_app():
     app.register_blueprint(ingredient_bp)
     app.register_blueprint(allergy_bp)
 
+    # the profile summary shows SQL so it only exists while profiling is turned on
+    if app.config["PROFILE_REQUESTS"]:
+        from Controllers.debug_controller import debug_bp
+
+        app.register_blueprint(debug_bp)
+
+    if app.config["METRICS_ENABLED"]:
+        if not app.config["METRICS_TOKEN"]:
+            raise RuntimeError(
+                "METRICS_ENABLED needs a METRICS_TOKEN to protect /metrics"
+            )
+        from Controllers.metrics_controller import metrics_bp
+
+        app.register_blueprint(metrics_bp)
+
     @app.route("/")
     def index():
         return "Hello and welcome to my recipe api!"
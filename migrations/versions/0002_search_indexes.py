@@ -0,0 +1,78 @@
+"""full text and trigram search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 17:05:12.418032
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(instructions, '')), 'B')"
+)
+
+
+def upgrade():
+    # tsvector and pg_trgm are postgres features, other databases fall back to ILIKE searches
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.execute(
+        "ALTER TABLE recipes ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED"
+    )
+    op.create_index(
+        "ix_recipes_search_vector",
+        "recipes",
+        ["search_vector"],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+    op.create_index(
+        "ix_recipes_title_trgm",
+        "recipes",
+        ["title"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"title": "gin_trgm_ops"},
+    )
+    op.create_index(
+        "ix_ingredient_name_trgm",
+        "ingredient",
+        ["name"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+    op.create_index(
+        "ix_allergy_name_trgm",
+        "allergy",
+        ["name"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.drop_index("ix_allergy_name_trgm", table_name="allergy")
+    op.drop_index("ix_ingredient_name_trgm", table_name="ingredient")
+    op.drop_index("ix_recipes_title_trgm", table_name="recipes")
+    op.drop_index("ix_recipes_search_vector", table_name="recipes")
+    op.drop_column("recipes", "search_vector")
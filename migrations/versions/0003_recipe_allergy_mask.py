@@ -0,0 +1,36 @@
+"""recipe allergy bitmask
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 17:48:40.902114
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "recipes",
+        sa.Column("allergy_mask", sa.BigInteger(), server_default="0", nullable=False),
+    )
+    # fill the mask in for the recipes that already exist, allergy ids 1 to 63
+    # each get a bit (see Functions/Index_functions.py)
+    op.execute(
+        "UPDATE recipes SET allergy_mask = ("
+        "SELECT coalesce(sum(DISTINCT CAST(1 AS BIGINT) << (allergy_id - 1)), 0) "
+        "FROM recipe_allergy WHERE recipe_allergy.recipe_id = recipes.id "
+        "AND allergy_id BETWEEN 1 AND 63)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("recipes") as batch_op:
+        batch_op.drop_column("allergy_mask")
@@ -0,0 +1,33 @@
+"""row versions for etags
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 18:21:07.415862
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+# every table a cached or etagged response is built from
+TABLES = ("recipes", "reviews", "users", "ingredient", "allergy")
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("version")
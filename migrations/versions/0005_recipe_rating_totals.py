@@ -0,0 +1,55 @@
+"""recipe rating totals
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 18:52:13.630418
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "recipes",
+        sa.Column("review_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.add_column(
+        "recipes",
+        sa.Column("rating_sum", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.add_column(
+        "recipes",
+        sa.Column("rating_avg", sa.Float(), server_default="0", nullable=False),
+    )
+    # work the totals out for the reviews that already exist
+    # (same as "flask db rebuild-ratings")
+    op.execute(
+        "UPDATE recipes SET "
+        "review_count = (SELECT count(*) FROM reviews "
+        "WHERE reviews.recipe_id = recipes.id), "
+        "rating_sum = (SELECT coalesce(sum(rating), 0) FROM reviews "
+        "WHERE reviews.recipe_id = recipes.id)"
+    )
+    op.execute(
+        "UPDATE recipes SET rating_avg = CASE WHEN review_count > 0 "
+        "THEN CAST(rating_sum AS FLOAT) / review_count ELSE 0 END"
+    )
+    op.create_index(
+        "ix_recipes_rating_avg_id", "recipes", ["rating_avg", "id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_recipes_rating_avg_id", table_name="recipes")
+    with op.batch_alter_table("recipes") as batch_op:
+        batch_op.drop_column("rating_avg")
+        batch_op.drop_column("rating_sum")
+        batch_op.drop_column("review_count")
@@ -0,0 +1,34 @@
+"""reviews recipe rating index
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 19:10:42.118305
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_reviews_recipe_rating_created",
+        "reviews",
+        [
+            "recipe_id",
+            sa.text("rating DESC"),
+            sa.text("created DESC"),
+            sa.text("id DESC"),
+        ],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_reviews_recipe_rating_created", table_name="reviews")
@@ -0,0 +1,74 @@
+"""foreign key indexes and join table unique constraints
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 19:34:55.207461
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the unique constraints can't be added while a recipe lists the same
+    # ingredient or allergy twice, keep the oldest row of every pair
+    op.execute(
+        "DELETE FROM recipe_ingredient WHERE id NOT IN ("
+        "SELECT min(id) FROM recipe_ingredient "
+        "GROUP BY recipe_id, ingredient_id)"
+    )
+    op.execute(
+        "DELETE FROM recipe_allergy WHERE id NOT IN ("
+        "SELECT min(id) FROM recipe_allergy "
+        "GROUP BY recipe_id, allergy_id)"
+    )
+
+    op.create_index(op.f("ix_recipes_user_id"), "recipes", ["user_id"], unique=False)
+    op.create_index(op.f("ix_reviews_user_id"), "reviews", ["user_id"], unique=False)
+    op.create_index(
+        op.f("ix_recipe_ingredient_ingredient_id"),
+        "recipe_ingredient",
+        ["ingredient_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_recipe_allergy_allergy_id"),
+        "recipe_allergy",
+        ["allergy_id"],
+        unique=False,
+    )
+
+    with op.batch_alter_table("recipe_ingredient") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_recipe_ingredient_recipe_id_ingredient_id",
+            ["recipe_id", "ingredient_id"],
+        )
+    with op.batch_alter_table("recipe_allergy") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_recipe_allergy_recipe_id_allergy_id", ["recipe_id", "allergy_id"]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("recipe_allergy") as batch_op:
+        batch_op.drop_constraint(
+            "uq_recipe_allergy_recipe_id_allergy_id", type_="unique"
+        )
+    with op.batch_alter_table("recipe_ingredient") as batch_op:
+        batch_op.drop_constraint(
+            "uq_recipe_ingredient_recipe_id_ingredient_id", type_="unique"
+        )
+
+    op.drop_index(op.f("ix_recipe_allergy_allergy_id"), table_name="recipe_allergy")
+    op.drop_index(
+        op.f("ix_recipe_ingredient_ingredient_id"), table_name="recipe_ingredient"
+    )
+    op.drop_index(op.f("ix_reviews_user_id"), table_name="reviews")
+    op.drop_index(op.f("ix_recipes_user_id"), table_name="recipes")
@@ -0,0 +1,28 @@
+# Production launcher, runs the app under gunicorn with the settings in gunicorn.conf.py and APP_ENV=production:
+#   WEB_CONCURRENCY=4 WEB_THREADS=8 python serve.py
+# --async (or SERVER_MODE=async) runs the ASGI app instead, the read endpoints on an event loop with asyncpg (see asgi.py)
+# any extra arguments are passed on to gunicorn, e.g. python serve.py --bind 127.0.0.1:5000
+import os
+import sys
+from gunicorn.app.wsgiapp import run
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+if __name__ == "__main__":
+    os.environ.setdefault("APP_ENV", "production")
+    arguments = sys.argv[1:]
+    app = "main:create_app()"
+    if "--async" in arguments or os.environ.get("SERVER_MODE") == "async":
+        arguments = [argument for argument in arguments if argument != "--async"]
+        arguments = ["--worker-class", "uvicorn.workers.UvicornWorker", *arguments]
+        app = "asgi:create_asgi_app()"
+    sys.argv = [
+        "gunicorn",
+        "--config",
+        os.path.join(HERE, "gunicorn.conf.py"),
+        "--chdir",
+        HERE,
+        *arguments,
+        app,
+    ]
+    run()
@@ -0,0 +1,29 @@
+# run the tests with python -m pytest, install requirements-dev.txt first
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    # every test run gets its own sqlite database, never the one in DATABASE_URI
+    os.environ["DATABASE_URI"] = (
+        f"sqlite:///{tmp_path_factory.mktemp('db') / 'recipe_api_test.db'}"
+    )
+    os.environ.setdefault("JWT_SECRET_KEY", "test")
+    # hash on the request thread and leave out the cache and limiter so the tests only see the endpoints themselves
+    os.environ["PASSWORD_WORKERS"] = "0"
+    os.environ["BCRYPT_LOG_ROUNDS"] = "4"
+    os.environ["CACHE_BACKEND"] = "none"
+    os.environ["RATELIMIT_BACKEND"] = "none"
+
+    from main import create_app
+
+    app = create_app()
+    runner = app.test_cli_runner()
+    for command in (["db", "create"], ["db", "seed"]):
+        result = runner.invoke(args=command)
+        assert result.exit_code == 0, result.output
+    return app
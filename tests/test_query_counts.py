@@ -0,0 +1,33 @@
+from init import db
+from Controllers.cli_controller import (
+    RECIPE_READ_QUERY_LIMITS,
+    count_recipe_read_queries,
+)
+from Functions.bulk_seeding_function import seed_bulk
+
+
+def check_counts(app):
+    with app.app_context():
+        counts = count_recipe_read_queries(app)
+    for name, (status, count) in counts.items():
+        assert status == 200, name
+        assert count <= RECIPE_READ_QUERY_LIMITS[name], f"{name}: {count} queries"
+    return counts
+
+
+def test_recipe_reads_use_a_fixed_number_of_queries(app):
+    small = check_counts(app)
+
+    # more recipes than a page, a batch or one selectin load can hold, the counts must not change
+    with app.app_context():
+        seed_bulk(
+            users=20,
+            recipes=1200,
+            reviews_per_recipe=3,
+            ingredients=300,
+            seed=1,
+            progress=lambda *args: None,
+        )
+        db.session.commit()
+
+    assert check_counts(app) == small
@@ -0,0 +1,53 @@
+from sqlalchemy import func
+from init import db
+from Models.recipe import Recipe
+from Models.review import Review
+
+
+def login(client, name, email):
+    client.post(
+        "/auth/register",
+        json={"name": name, "email": email, "password": "Coderacademy1!"},
+    )
+    response = client.post(
+        "/auth/login", json={"email": email, "password": "Coderacademy1!"}
+    )
+    return {"Authorization": f"Bearer {response.get_json()['token']}"}
+
+
+def stored_and_actual(recipe_id):
+    recipe = db.session.get(Recipe, recipe_id)
+    db.session.refresh(recipe)
+    count, total = db.session.execute(
+        db.select(
+            func.count(Review.id), func.coalesce(func.sum(Review.rating), 0)
+        ).filter(Review.recipe_id == recipe_id)
+    ).one()
+    return (recipe.review_count, recipe.rating_sum, recipe.rating_avg), (
+        count,
+        total,
+        total / count if count else 0.0,
+    )
+
+
+def test_deleting_a_reviewer_updates_recipe_ratings(app):
+    client = app.test_client()
+    headers = login(client, "zed", "zed@email.com")
+    response = client.post(
+        "/review/1", headers=headers, json={"details": "Lovely", "rating": 9}
+    )
+    assert response.status_code == 201
+
+    with app.app_context():
+        stored, actual = stored_and_actual(1)
+        assert stored == actual
+        user_id = db.session.scalar(
+            db.select(Review.user_id).filter_by(recipe_id=1, details="Lovely")
+        )
+
+    response = client.delete(f"/auth/user/{user_id}", headers=headers)
+    assert response.status_code == 200
+
+    with app.app_context():
+        stored, actual = stored_and_actual(1)
+        assert stored == actual